@@ -0,0 +1,288 @@
+#!/usr/bin/env python3
+
+# Offline benchmarks for the conversion hot paths
+# Generates synthetic fixtures (see fixtures.py) and times single file
+# conversion, folder throughput per number of workers, walking a large tree,
+# archive copy/move bandwidth, the encoder presets and the startup time of the script. Every
+# scenario is run several times and the fastest run counts. Results are
+# written as json and can be compared against a previous result file,
+# regressions make the script exit with status 1.
+#
+# Example:
+#   ./benchmarks/benchmark.py --output baseline.json
+#   ./benchmarks/benchmark.py --compare baseline.json
+
+import argparse
+import importlib.util
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import fixtures
+
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SCRIPT = os.path.join(REPO, 'raw-to-jpg.py')
+
+sys.path.insert(0, REPO)
+
+# modes that do not convert images must start without these
+HEAVY_MODULES = ('gi', 'numpy', 'rawpy', 'PIL')
+
+# runs the script given as first argument and prints the heavy modules it imported
+IMPORT_CHECK = '''
+import json, os, runpy, sys
+sys.argv = sys.argv[1:]
+sys.path.insert(0, os.path.dirname(sys.argv[0]))
+try:
+    runpy.run_path(sys.argv[0], run_name='__main__')
+except SystemExit:
+    pass
+print(json.dumps([name for name in %r if name in sys.modules]))
+''' % (HEAVY_MODULES,)
+
+
+def load_script():
+    spec = importlib.util.spec_from_file_location('raw_to_jpg', SCRIPT)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def run_script(*args):
+    subprocess.run([sys.executable, SCRIPT, '-q', '--no-manifest'] + list(args), check=True)
+
+
+# fastest of repeat runs of function, setup runs before every run and is not timed
+def best_time(function, repeat, setup=None):
+    times = []
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def result(seconds, amount, unit):
+    return { 'seconds': seconds, 'throughput': amount / seconds if seconds > 0 else 0.0, 'unit': unit }
+
+
+def clear(path):
+    shutil.rmtree(path, ignore_errors=True)
+    os.makedirs(path)
+
+
+def bench_single_file(workdir, options):
+    script = load_script()
+    src = os.path.join(workdir, 'single')
+    dst = os.path.join(workdir, 'single-out')
+    fixtures.raw_folder(src, 1, options.width, options.height)
+    megapixels = options.width * options.height / 1e6
+    seconds = best_time(lambda: script.convert_raw_to_jpg(src, dst, '/IMG_0000.dng', verbose=False, overwrite=True),
+                        options.repeat, setup=lambda: clear(dst))
+    return { 'single_file': result(seconds, megapixels, 'MP/s') }
+
+
+def bench_folder(workdir, options):
+    src = os.path.join(workdir, 'folder')
+    dst = os.path.join(workdir, 'folder-out')
+    fixtures.raw_folder(src, options.files, options.width, options.height)
+    megapixels = options.files * options.width * options.height / 1e6
+    results = {}
+    for workers in options.workers:
+        seconds = best_time(lambda: run_script('-f', '-j', str(workers), src, dst), options.repeat, setup=lambda: clear(dst))
+        results['folder_jobs_' + str(workers)] = result(seconds, megapixels, 'MP/s')
+    return results
+
+
+def bench_tree_walk(workdir, options):
+    import r2j_scan
+    src = os.path.join(workdir, 'tree')
+    fixtures.file_tree(src, folders=options.folders, files=options.tree_files)
+
+    def walk():
+        for folder, files in r2j_scan.Scanner(src).walk(''):
+            pass
+
+    seconds = best_time(walk, options.repeat)
+    return { 'tree_walk': result(seconds, options.folders * options.tree_files, 'files/s') }
+
+
+def bench_archive(workdir, options):
+    src = os.path.join(workdir, 'archive')
+    moving = os.path.join(workdir, 'archive-move')
+    dst = os.path.join(workdir, 'archive-out')
+    fixtures.archive_folder(src, options.archive_files, options.archive_size * 1024 * 1024)
+    megabytes = options.archive_files * options.archive_size
+
+    # the files to move are hardlinks, so the fixture survives
+    def link_source():
+        clear(dst)
+        clear(moving)
+        for name in os.listdir(src):
+            os.link(os.path.join(src, name), os.path.join(moving, name))
+
+    results = {}
+    for workers in sorted(set([1, max(options.workers)])):
+        seconds = best_time(lambda: run_script('-c', '-j', str(workers), src, dst), options.repeat, setup=lambda: clear(dst))
+        results['archive_copy_jobs_' + str(workers)] = result(seconds, megabytes, 'MB/s')
+    seconds = best_time(lambda: run_script('-m', moving, dst), options.repeat, setup=link_source)
+    results['archive_move'] = result(seconds, megabytes, 'MB/s')
+    return results
+
+
+# encoding speed and file size of every preset and format, on a decoded fixture
+def bench_encode(workdir, options):
+    import io
+    import r2j_converter
+    import r2j_encoders
+    import r2j_renditions
+    src = os.path.join(workdir, 'encode')
+    fixtures.raw_folder(src, 1, options.width, options.height)
+    rgb = r2j_converter.decode_raw(os.path.join(src, 'IMG_0000.dng'), src, '/IMG_0000.dng')
+    megapixels = options.width * options.height / 1e6
+    results = {}
+    for fmt in ('jpg', 'webp', 'tiff'):
+        rendered = next(r2j_renditions.render(rgb, [('', fmt, None)]))[1]
+        for preset in sorted(r2j_encoders.PRESETS):
+            settings = r2j_encoders.encoder_settings(preset)
+            buffer = io.BytesIO()
+
+            def encode():
+                buffer.seek(0)
+                buffer.truncate()
+                r2j_encoders.encode_image(rendered, fmt, buffer, settings=settings)
+
+            seconds = best_time(encode, options.repeat)
+            results['encode_' + fmt + '_' + preset] = dict(result(seconds, megapixels, 'MP/s'), bytes=buffer.tell())
+    return results
+
+
+def bench_startup(workdir, options):
+    src = os.path.join(workdir, 'startup')
+    dst = os.path.join(workdir, 'startup-out')
+    clear(src)
+    results = {}
+    for name, args in (('startup_help', ['--help']), ('startup_archive', ['-q', '-c', src, dst])):
+        check = subprocess.run([sys.executable, '-c', IMPORT_CHECK, SCRIPT] + args, stdout=subprocess.PIPE, check=True, text=True)
+        loaded = json.loads(check.stdout.splitlines()[-1])
+        if loaded:
+            sys.exit('Error: ' + ' '.join(args) + ' imports ' + ', '.join(loaded))
+        # startup is short and noisy, so it gets more runs
+        seconds = best_time(lambda: subprocess.run([sys.executable, SCRIPT] + args, stdout=subprocess.DEVNULL, check=True),
+                            options.repeat * 5)
+        results[name] = result(seconds, 1, 'runs/s')
+    return results
+
+
+SCENARIOS = {
+    'single': bench_single_file,
+    'folder': bench_folder,
+    'walk': bench_tree_walk,
+    'archive': bench_archive,
+    'encode': bench_encode,
+    'startup': bench_startup,
+}
+
+
+def environment():
+    import numpy
+    import rawpy
+    return {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        'numpy': numpy.__version__,
+        'rawpy': rawpy.__version__,
+        'libraw': '.'.join(str(part) for part in rawpy.libraw_version),
+    }
+
+
+# returns the names of the scenarios that got slower than the tolerance allows
+def compare(results, baseline, tolerance):
+    regressions = []
+    print('%-24s %12s %12s %8s' % ('scenario', 'baseline', 'current', 'change'))
+    for name, current in sorted(results.items()):
+        if name not in baseline:
+            print('%-24s %12s %12.3f %8s' % (name, '-', current['seconds'], 'new'))
+            continue
+        before = baseline[name]['seconds']
+        change = current['seconds'] / before - 1 if before > 0 else 0.0
+        flag = ''
+        if change > tolerance:
+            regressions.append(name)
+            flag = '  REGRESSION'
+        print('%-24s %12.3f %12.3f %+7.1f%%%s' % (name, before, current['seconds'], change * 100, flag))
+    return regressions
+
+
+def worker_list(spec):
+    try:
+        return [int(workers) for workers in spec.split(',')]
+    except ValueError:
+        raise argparse.ArgumentTypeError('expected a comma separated list like 1,2,4')
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Benchmark raw-to-jpg with synthetic fixtures')
+    parser.add_argument('--compare', help='result file of an earlier run, exit with status 1 on regressions', type=str)
+    parser.add_argument('--output', help='write the results as json to this file', type=str)
+    parser.add_argument('--repeat', help='runs per scenario, the fastest counts (default: 3)', type=int, default=3)
+    parser.add_argument('--scenario', help='only run these scenarios (default: all)', action='append',
+                        choices=sorted(SCENARIOS.keys()), dest='scenarios')
+    parser.add_argument('--tolerance', help='allowed slowdown before a scenario counts as regression (default: 0.15)',
+                        type=float, default=0.15)
+    parser.add_argument('--workdir', help='keep the fixtures in this folder instead of a temporary one', type=str)
+    parser.add_argument('--workers', help='worker counts for the folder benchmark (default: 1,2,4)', type=worker_list,
+                        default=[1, 2, 4])
+    parser.add_argument('--quick', help='small fixtures for a fast smoke run', action='store_true')
+    options = parser.parse_args()
+
+    options.width, options.height = (600, 400) if options.quick else (6000, 4000)
+    options.files = 4 if options.quick else 16
+    options.folders, options.tree_files = (50, 20) if options.quick else (2000, 50)
+    options.archive_files, options.archive_size = (2, 4) if options.quick else (8, 64)
+    return options
+
+
+if __name__ == '__main__':
+    options = parse_args()
+    workdir = options.workdir or tempfile.mkdtemp(prefix='raw-to-jpg-bench-')
+    os.makedirs(workdir, exist_ok=True)
+
+    results = {}
+    try:
+        for name in options.scenarios or SCENARIOS.keys():
+            print('Running ' + name + ' benchmark...')
+            results.update(SCENARIOS[name](workdir, options))
+    finally:
+        if not options.workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    for name, values in sorted(results.items()):
+        size = ' %10d bytes' % values['bytes'] if 'bytes' in values else ''
+        print('%-24s %10.3f s %12.1f %s%s' % (name, values['seconds'], values['throughput'], values['unit'], size))
+
+    if options.output:
+        with open(options.output, 'w') as f:
+            json.dump({ 'environment': environment(), 'quick': options.quick, 'results': results }, f, indent=2, sort_keys=True)
+
+    if options.compare:
+        with open(options.compare) as f:
+            baseline = json.load(f)
+        print()
+        if baseline.get('quick') != options.quick:
+            print('Error: the baseline was recorded with different fixture sizes (--quick)')
+            sys.exit(2)
+        regressions = compare(results, baseline['results'], options.tolerance)
+        if regressions:
+            print()
+            print(str(len(regressions)) + ' regressions: ' + ', '.join(regressions))
+            sys.exit(1)
@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+
+# Synthetic fixtures for the benchmarks
+# The raws are minimal uncompressed DNGs with a bayer pattern, which libraw
+# decodes like any camera file. Everything is seeded, so fixtures are identical
+# between runs and machines.
+
+import numpy
+import os
+import struct
+
+
+BYTE = 1
+ASCII = 2
+SHORT = 3
+LONG = 4
+RATIONAL = 5
+SRATIONAL = 10
+
+FORMATS = { BYTE: 'B', SHORT: 'H', LONG: 'I', RATIONAL: 'II', SRATIONAL: 'ii' }
+
+
+def write_dng(path, width=3000, height=2000, seed=0, model='Benchmark Camera'):
+    rng = numpy.random.default_rng(seed)
+    # smooth gradient plus noise, so jpeg encoding has realistic work to do
+    gradient = numpy.add.outer(numpy.linspace(0, 1500, height), numpy.linspace(0, 1500, width))
+    data = (gradient + rng.integers(256, 1000, size=(height, width))).astype('<u2').tobytes()
+    model = model.encode('ascii') + b'\0'
+
+    tags = [
+        (254, LONG, [0]),
+        (256, LONG, [width]),
+        (257, LONG, [height]),
+        (258, SHORT, [16]),
+        (259, SHORT, [1]),
+        (262, SHORT, [32803]),          # color filter array
+        (271, ASCII, b'Synthetic\0'),
+        (272, ASCII, model),
+        (273, LONG, [0]),               # strip offset, filled in below
+        (277, SHORT, [1]),
+        (278, LONG, [height]),
+        (279, LONG, [len(data)]),
+        (284, SHORT, [1]),
+        (33421, SHORT, [2, 2]),         # cfa repeat pattern
+        (33422, BYTE, [0, 1, 1, 2]),    # rggb
+        (50706, BYTE, [1, 4, 0, 0]),    # dng version
+        (50708, ASCII, model),
+        (50714, LONG, [0]),             # black level
+        (50717, LONG, [4095]),          # white level
+        (50721, SRATIONAL, [(1, 1), (0, 1), (0, 1), (0, 1), (1, 1), (0, 1), (0, 1), (0, 1), (1, 1)]),
+        (50728, RATIONAL, [(1, 1), (1, 1), (1, 1)]),
+        (50778, SHORT, [21]),           # d65
+    ]
+
+    entries = []
+    for tag, typ, values in tags:
+        if typ == ASCII:
+            raw = values
+        elif typ in (RATIONAL, SRATIONAL):
+            raw = b''.join(struct.pack('<' + FORMATS[typ], *value) for value in values)
+        else:
+            raw = struct.pack('<%d%s' % (len(values), FORMATS[typ]), *values)
+        count = len(values)
+        entries.append([tag, typ, count, raw])
+
+    # values larger than 4 bytes go behind the ifd, the image data at the end
+    ifd_offset = 8
+    extra_offset = ifd_offset + 2 + len(entries) * 12 + 4
+    extra = b''
+    for entry in entries:
+        if len(entry[3]) > 4:
+            entry.append(extra_offset + len(extra))
+            extra += entry[3] + b'\0' * (len(entry[3]) % 2)
+        else:
+            entry.append(None)
+    strip_offset = extra_offset + len(extra)
+
+    with open(path, 'wb') as f:
+        f.write(b'II*\0' + struct.pack('<I', ifd_offset) + struct.pack('<H', len(entries)))
+        for tag, typ, count, raw, offset in entries:
+            if tag == 273:
+                raw = struct.pack('<I', strip_offset)
+            f.write(struct.pack('<HHI', tag, typ, count))
+            f.write(struct.pack('<I', offset) if offset is not None else raw.ljust(4, b'\0'))
+        f.write(struct.pack('<I', 0))
+        f.write(extra)
+        f.write(data)
+
+
+def raw_folder(path, count, width=3000, height=2000):
+    os.makedirs(path, exist_ok=True)
+    for i in range(count):
+        write_dng(os.path.join(path, 'IMG_%04d.dng' % i), width=width, height=height, seed=i)
+
+
+# folders * files small non raw files, spread over a tree of the given depth
+def file_tree(path, folders=200, files=50, depth=3):
+    for i in range(folders):
+        parts = [path] + ['d%d' % ((i // (8 ** level)) % 8) for level in range(depth - 1)] + ['f%d' % i]
+        folder = os.path.join(*parts)
+        os.makedirs(folder, exist_ok=True)
+        for j in range(files):
+            with open(os.path.join(folder, 'file_%d.txt' % j), 'w') as f:
+                f.write(str(j))
+
+
+# large files with a raw ending for archive mode
+def archive_folder(path, count=8, size=32 * 1024 * 1024):
+    os.makedirs(path, exist_ok=True)
+    rng = numpy.random.default_rng(0)
+    for i in range(count):
+        with open(os.path.join(path, 'IMG_%04d.CR2' % i), 'wb') as f:
+            f.write(rng.integers(0, 256, size=size, dtype=numpy.uint8).tobytes())
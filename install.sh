@@ -1,7 +1,7 @@
 #!/bin/sh
 
 cp -v raw-to-jpg.py $HOME/.local/bin/raw-to-jpg
-cp -v r2j_linuxgui.py $HOME/.local/bin/
+cp -v r2j_*.py $HOME/.local/bin/
 cp -v raw-to-jpg.desktop $HOME/.local/share/applications
 
 echo
@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+
+# Fast file transfer for archive mode
+# Moves on the same filesystem are plain renames. Copies try a reflink clone
+# first, then let the kernel copy the data (copy_file_range, sendfile) and only
+# fall back to copying through userspace if none of that is supported.
+# Files are copied to a temporary name and renamed into place when complete.
+# Before a moved source is removed the copy is flushed to the disk, and verified
+# copies are read back from the disk instead of the page cache.
+
+import errno
+import hashlib
+import os
+import shutil
+try:
+    import fcntl
+except ImportError:
+    # not available on windows
+    fcntl = None
+
+import r2j_shard
+
+
+# ioctl that clones a file on copy-on-write filesystems (btrfs, xfs, ...)
+FICLONE = 0x40049409
+
+CHUNK_SIZE = 64 * 1024 * 1024
+BUFFER_SIZE = 4 * 1024 * 1024
+
+
+def checksum(path):
+    digest = hashlib.blake2b()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(BUFFER_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+# flush the data and metadata of a file to the disk
+def sync_file(path):
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+# flush the entries of a folder, so a renamed file survives a crash
+def sync_folder(path):
+    if not hasattr(os, 'O_DIRECTORY'):
+        # folders can not be opened on windows
+        return
+    fd = os.open(path, os.O_RDONLY | os.O_DIRECTORY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+# drop the cached pages of a (synced) file, so it is read back from the disk
+def drop_cache(path):
+    if not hasattr(os, 'posix_fadvise'):
+        return
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+    finally:
+        os.close(fd)
+
+
+def reflink(src_fd, dst_fd):
+    if fcntl is None:
+        return False
+    try:
+        fcntl.ioctl(dst_fd, FICLONE, src_fd)
+        return True
+    except OSError:
+        return False
+
+
+# copy the data with the kernel, returns False if the files do not support it
+def kernel_copy(src_fd, dst_fd, size):
+    for copy in (getattr(os, 'copy_file_range', None), os.sendfile):
+        if copy is None:
+            continue
+        offset = 0
+        try:
+            while offset < size:
+                if copy is os.sendfile:
+                    copied = copy(dst_fd, src_fd, offset, min(CHUNK_SIZE, size - offset))
+                else:
+                    copied = copy(src_fd, dst_fd, min(CHUNK_SIZE, size - offset), offset, offset)
+                if copied == 0:
+                    break
+                offset += copied
+            if offset == size:
+                return True
+        except OSError as e:
+            if e.errno not in (errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP, errno.ENOTSUP, errno.ENOTSOCK):
+                raise
+        # start over with the next method
+        os.lseek(dst_fd, 0, os.SEEK_SET)
+        os.ftruncate(dst_fd, 0)
+    return False
+
+
+# copy with metadata (like shutil.copy2)
+# durable copies are on the disk when this returns (the source may be removed then)
+# returns the method that was used
+def copy_file(src, dst, verify=False, durable=False):
+    temp = r2j_shard.temp_path(dst)
+    try:
+        with open(src, 'rb') as fsrc, open(temp, 'wb') as fdst:
+            size = os.fstat(fsrc.fileno()).st_size
+            if reflink(fsrc.fileno(), fdst.fileno()):
+                method = 'cloned'
+            elif kernel_copy(fsrc.fileno(), fdst.fileno(), size):
+                method = 'copied'
+            else:
+                shutil.copyfileobj(fsrc, fdst, BUFFER_SIZE)
+                method = 'copied'
+        shutil.copystat(src, temp)
+        if durable or verify:
+            sync_file(temp)
+        if verify:
+            drop_cache(temp)
+            if checksum(src) != checksum(temp):
+                raise IOError('checksum mismatch after copying ' + src)
+        os.replace(temp, dst)
+        if durable:
+            sync_folder(os.path.dirname(os.path.abspath(dst)))
+        return method
+    except BaseException:
+        if os.path.exists(temp):
+            os.remove(temp)
+        raise
+
+
+# returns the method that was used
+def move_file(src, dst, verify=False):
+    try:
+        os.replace(src, dst)
+        return 'renamed'
+    except OSError as e:
+        if e.errno != errno.EXDEV:
+            raise
+    # different filesystems, the source is only removed once the copy is complete (and verified)
+    method = copy_file(src, dst, verify=verify, durable=True)
+    os.remove(src)
+    return method + ' and removed'
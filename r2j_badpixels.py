@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+
+# Bad pixel maps for group enhancing
+# Finding bad pixels compares many images of the same sensor and is by far the
+# most expensive part of -g. Maps are computed once per camera body (or per
+# folder if the body is unknown, bad pixels belong to a single sensor) and kept
+# in a cache file, so other folders and later runs can reuse them. Maps of only
+# a few images are not reliable enough to be reused and are not cached.
+
+import hashlib
+import importlib
+import json
+import numpy
+import os
+
+import r2j_exif
+import r2j_shard
+
+
+CACHE_FILE = os.path.join(os.environ.get('XDG_CACHE_HOME', os.path.expanduser('~/.cache')),
+                          'raw-to-jpg', 'bad_pixels.json')
+
+# sensors develop new hot pixels over time, so a map is only reused for images
+# taken within this many seconds of the images it was computed from
+MAX_AGE = 30 * 24 * 60 * 60
+
+# images a map must be computed from to be cached
+MIN_SOURCES = 5
+
+
+def camera_key(path):
+    tags = r2j_exif.read_camera_tags(path)
+    if not tags['model'] or not tags['serial']:
+        # other bodies of the model have other bad pixels
+        return None
+    return '/'.join((tags['make'], tags['model'], tags['serial']))
+
+
+class BadPixelCache:
+    def __init__(self, cache_file=CACHE_FILE, max_age=MAX_AGE):
+        self.cache_file = cache_file
+        self.max_age = max_age
+        self.dirty = False
+        try:
+            with open(cache_file) as f:
+                self.entries = json.load(f)
+        except (OSError, ValueError):
+            self.entries = {}
+
+    def lookup(self, key, sources, timestamp):
+        entry = self.entries.get(key)
+        if entry is None or entry.get('files', 0) < MIN_SOURCES:
+            return None
+        if entry['sources'] != sources and abs(entry['time'] - timestamp) > self.max_age:
+            return None
+        return numpy.array(entry['coords'], dtype=int).reshape(-1, 2)
+
+    def store(self, key, sources, timestamp, coords, files):
+        if files < MIN_SOURCES:
+            return
+        self.entries[key] = { 'sources': sources, 'time': timestamp, 'files': files, 'coords': numpy.asarray(coords).tolist() }
+        self.dirty = True
+
+    def save(self):
+        if not self.dirty:
+            return
+        os.makedirs(os.path.dirname(self.cache_file), exist_ok=True)
+        temp_file = r2j_shard.temp_path(self.cache_file)
+        with open(temp_file, 'w') as f:
+            json.dump(self.entries, f)
+        os.replace(temp_file, self.cache_file)
+        self.dirty = False
+
+    # maps every path to the bad pixel coordinates of its camera
+    def bad_pixel_maps(self, paths, verbose=True):
+        groups = {}
+        for path in paths:
+            key = camera_key(path) or 'folder:' + os.path.dirname(os.path.abspath(path))
+            groups.setdefault(key, []).append(path)
+
+        maps = {}
+        for key, group in groups.items():
+            stats = sorted((os.path.abspath(path), os.stat(path)) for path in group)
+            sources = hashlib.sha1(repr([(path, stat.st_size, stat.st_mtime_ns) for path, stat in stats]).encode()).hexdigest()
+            timestamp = max(stat.st_mtime for path, stat in stats)
+            coords = self.lookup(key, sources, timestamp)
+            if coords is None:
+                if verbose:
+                    print('...' + key + '\t\t => searching bad pixels in ' + str(len(group)) + ' files')
+                coords = importlib.import_module('rawpy.enhance').find_bad_pixels(group)
+                self.store(key, sources, timestamp, coords, len(group))
+            for path in group:
+                maps[path] = coords
+        return maps
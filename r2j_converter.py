@@ -0,0 +1,220 @@
+#!/usr/bin/env python3
+
+# Importable conversion API
+# A Converter holds the conversion settings and turns an iterable of raw files
+# (paths or in-memory buffers) into encoded images. Results are yielded as soon
+# as each file is done, while reading, decoding and encoding of the following
+# files overlap (see r2j_pipeline). Keeping one converter around avoids the
+# startup cost of running the script for every file:
+#
+#   import r2j_converter
+#   converter = r2j_converter.Converter(format='jpg', quality=85, size=2048)
+#   for result in converter.convert(['a.CR2', ('upload.nef', data)]):
+#       if result['error'] is None:
+#           store(result['path'], result['data'])
+#
+# The decoding functions are shared with raw-to-jpg.py.
+
+import io
+import os
+
+import r2j_encoders
+import r2j_exif
+import r2j_pipeline
+import r2j_renditions
+import r2j_report
+import r2j_shard
+
+
+BUFFER_TYPES = (bytes, bytearray, memoryview)
+
+
+# decode a raw file (path or in-memory buffer) into an rgb array
+# in preview mode the embedded jpeg of the camera is returned as bytes if there is one,
+# otherwise (and with half_size) libraw decodes at half resolution without real demosaicing
+def decode_raw(source, in_path, path, auto_wb=False, enhance=False, preview=False, half_size=False, output_bps=8, record=None):
+    import numpy
+    import rawpy
+    if isinstance(source, BUFFER_TYPES):
+        source = io.BytesIO(source)
+    with r2j_report.stage(record, 'open'):
+        raw = rawpy.imread(source)
+    with raw:
+        if record is not None:
+            record['megapixels'] = raw.sizes.width * raw.sizes.height / 1e6
+        if preview:
+            try:
+                # jpeg previews come as bytes, bitmaps as rgb arrays
+                with r2j_report.stage(record, 'thumbnail'):
+                    thumb = raw.extract_thumb()
+                if thumb.format in (rawpy.ThumbFormat.JPEG, rawpy.ThumbFormat.BITMAP):
+                    return orient_thumbnail(thumb.data, raw.sizes.flip)
+            except (rawpy.LibRawNoThumbnailError, rawpy.LibRawUnsupportedThumbnailError):
+                pass
+            half_size = True
+        # enhance
+        if isinstance(enhance, numpy.ndarray) or enhance:
+            with r2j_report.stage(record, 'enhance'):
+                enhance_raw(raw, in_path, path, enhance)
+        options = dict(output_bps=output_bps)
+        if half_size:
+            options.update(half_size=True, demosaic_algorithm=rawpy.DemosaicAlgorithm.LINEAR)
+        # post processing (with white balance of camera)
+        with r2j_report.stage(record, 'postprocess'):
+            if auto_wb:
+                return raw.postprocess(use_auto_wb=True, **options)
+            else:
+                return raw.postprocess(use_camera_wb=True, **options)
+
+
+# turn an embedded preview like postprocess() turns the decoded image
+# jpegs get an exif orientation instead, so they can still be written as they are
+def orient_thumbnail(data, flip):
+    import numpy
+    if flip not in r2j_exif.FLIP_ORIENTATION:
+        return data
+    if isinstance(data, bytes):
+        return r2j_exif.add_orientation(data, r2j_exif.FLIP_ORIENTATION[flip])
+    # 5 is a quarter turn counterclockwise, 6 clockwise
+    return numpy.ascontiguousarray(numpy.rot90(data, { 3: 2, 5: 1, 6: -1 }[flip]))
+
+
+# remove bad pixels
+def enhance_raw(raw, in_path, path, enhance):
+    import numpy
+    import rawpy.enhance
+    if type(enhance) == bool:
+        bad_pixels = rawpy.enhance.find_bad_pixels([in_path + path])
+    elif isinstance(enhance, numpy.ndarray):
+        # precomputed bad pixel map (group enhance)
+        bad_pixels = enhance
+    else:
+        bad_pixels = rawpy.enhance.find_bad_pixels(enhance)
+    rawpy.enhance.repair_bad_pixels(raw, bad_pixels)
+
+
+def image_size(rendered):
+    if isinstance(rendered, bytes):
+        from PIL import Image
+        image = Image.open(io.BytesIO(rendered))
+        if image.getexif().get(r2j_exif.ORIENTATION, 1) in (5, 6, 7, 8):
+            return image.height, image.width
+        return image.size
+    if hasattr(rendered, 'shape'):
+        return rendered.shape[1], rendered.shape[0]
+    return rendered.size
+
+
+class Converter:
+    # format: jpg, webp, tiff or tiff16, size: longest edge in pixels (None keeps the full resolution)
+    # enhance: True to find bad pixels in every file itself (paths only) or a precomputed bad pixel map
+    # preset, quality, optimize, progressive, subsampling, compression: encoder settings (see r2j_encoders)
+    # destination: folder the images are written to, without one the encoded images are returned in the results
+    def __init__(self, auto_wb=False, enhance=False, format='jpg', preset='default', quality=None, optimize=None, progressive=None,
+                 subsampling=None, compression=None, size=None, preview=False, half_size=False, destination=None, queue_size=2):
+        if format not in r2j_renditions.FORMATS:
+            raise ValueError('unknown format ' + str(format) + ', expected one of ' + ', '.join(r2j_renditions.FORMATS))
+        if size is not None and size <= 0:
+            raise ValueError('size must be at least one pixel')
+        self.auto_wb = auto_wb
+        self.enhance = enhance
+        self.format = format
+        self.encoder = r2j_encoders.encoder_settings(preset, quality=quality, optimize=optimize, progressive=progressive,
+                                                     subsampling=subsampling, compression=compression)
+        self.size = size
+        self.preview = preview
+        self.half_size = half_size
+        self.destination = destination
+        self.queue_size = queue_size
+
+    # yields a result (dict) for every source in input order, as soon as it is converted
+    # sources are paths, buffers (bytes, bytearray, memoryview, binary file objects) or (name, buffer) pairs
+    # results are records like in r2j_report with these additional keys:
+    #   index, output (written file or None), data (encoded image if there is no destination),
+    #   width, height and error (message or None, failed files do not stop the iteration)
+    def convert(self, sources):
+        items = ((index,) + self.source_name(index, source) for index, source in enumerate(sources))
+        stages = [self.read, self.decode, self.save]
+        for (index, name, source), value, error in r2j_pipeline.run_pipeline(items, stages, queue_size=self.queue_size):
+            if error is not None:
+                result = self.new_result(index, name)
+                result['error'] = str(error)
+            else:
+                result = value
+            yield result
+
+    # convert a single source and return its result
+    def convert_one(self, source):
+        return next(self.convert([source]))
+
+    def source_name(self, index, source):
+        if isinstance(source, tuple):
+            return source
+        if isinstance(source, (str, os.PathLike)):
+            return os.fspath(source), os.fspath(source)
+        return 'buffer_' + str(index), source
+
+    def new_result(self, index, name):
+        result = r2j_report.new_record(name)
+        result.update(index=index, output=None, data=None, width=0, height=0, error=None)
+        return result
+
+    # pipeline stages
+    def read(self, item, value):
+        index, name, source = item
+        result = self.new_result(index, name)
+        with r2j_report.stage(result, 'read'):
+            if isinstance(source, (str, os.PathLike)):
+                result['camera'] = r2j_exif.read_camera_tags(source)['model']
+                with open(source, 'rb') as f:
+                    data = f.read()
+            elif isinstance(source, BUFFER_TYPES):
+                data = source
+            else:
+                data = source.read()
+        result['bytes_read'] = len(data)
+        return data, result
+
+    def decode(self, item, value):
+        index, name, source = item
+        data, result = value
+        if self.enhance is True and not isinstance(source, (str, os.PathLike)):
+            raise ValueError('finding bad pixels needs the path of the raw, pass a bad pixel map for buffers')
+        in_path = os.fspath(source) if isinstance(source, (str, os.PathLike)) else ''
+        image = decode_raw(data, in_path, '', auto_wb=self.auto_wb, enhance=self.enhance, preview=self.preview,
+                           half_size=self.half_size, output_bps=16 if self.format == 'tiff16' else 8, record=result)
+        return image, result
+
+    def save(self, item, value):
+        index, name, source = item
+        image, result = value
+        with r2j_report.stage(result, 'resample'):
+            rendition, rendered = next(r2j_renditions.render(image, [('', self.format, self.size)]))
+        result['width'], result['height'] = image_size(rendered)
+        buffer = io.BytesIO()
+        with r2j_report.stage(result, 'encode'):
+            r2j_encoders.encode_image(rendered, self.format, buffer, settings=self.encoder)
+        result['bytes_written'] = buffer.tell()
+        if self.destination is None:
+            result['data'] = buffer.getvalue()
+            return result
+
+        with r2j_report.stage(result, 'finalize'):
+            os.makedirs(self.destination, exist_ok=True)
+            file_without_ext = os.path.splitext(os.path.basename(name))[0]
+            output = os.path.join(self.destination, file_without_ext + r2j_renditions.FORMATS[self.format])
+            temp = r2j_shard.temp_path(output)
+            try:
+                with open(temp, 'wb') as f:
+                    f.write(buffer.getbuffer())
+                if isinstance(source, (str, os.PathLike)):
+                    # keep the timestamp of the raw file
+                    file_timestamp = os.path.getmtime(source)
+                    os.utime(temp, (file_timestamp, file_timestamp))
+                os.replace(temp, output)
+            except BaseException:
+                if os.path.exists(temp):
+                    os.remove(temp)
+                raise
+        result['output'] = output
+        return result
@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+
+# Content based deduplication of sources (--dedupe)
+# Card dumps are often imported more than once under different folder names.
+# Files are compared by size first, files of the same size by a hash of their
+# first and last block and only files that agree on that by a hash of their
+# whole content, so most files are read once or not at all. Each set of
+# duplicates is converted or copied only once, the other destinations become
+# hardlinks (or reflinks where hardlinks are not possible) of the result.
+# The fingerprints are kept in an index in the destination, so duplicates of
+# files from earlier runs are found as well and unchanged files (same size and
+# mtime) are never hashed twice.
+
+import errno
+import hashlib
+import os
+import sqlite3
+
+import r2j_archive
+import r2j_shard
+
+
+INDEX_NAME = '.raw-to-jpg-fingerprints.sqlite'
+
+# bytes hashed at the start and at the end of a file for the partial hash
+BLOCK_SIZE = 64 * 1024
+
+# entry fields
+SIZE, MTIME, PARTIAL, FULL = range(4)
+
+
+def partial_hash(path, size):
+    digest = hashlib.blake2b()
+    with open(path, 'rb') as f:
+        digest.update(f.read(BLOCK_SIZE))
+        if size > 2 * BLOCK_SIZE:
+            f.seek(-BLOCK_SIZE, os.SEEK_END)
+        digest.update(f.read())
+    return digest.hexdigest()
+
+
+# make dst a hardlink of src, or a reflink (or copy) if the filesystem can not link them
+# returns the method that was used
+def link_file(src, dst):
+    if os.path.exists(dst) and os.path.samefile(src, dst):
+        return 'hardlinked'
+    temp = r2j_shard.temp_path(dst)
+    try:
+        os.link(src, temp)
+    except OSError as e:
+        if e.errno not in (errno.EXDEV, errno.EPERM, errno.EMLINK, errno.ENOTSUP, errno.EOPNOTSUPP):
+            raise
+        return r2j_archive.copy_file(src, dst)
+    try:
+        os.replace(temp, dst)
+    except BaseException:
+        os.remove(temp)
+        raise
+    return 'hardlinked'
+
+
+class Index:
+    def __init__(self, directory, name=INDEX_NAME):
+        if not os.path.isdir(directory):
+            os.makedirs(directory, exist_ok=True)
+        self.connection = sqlite3.connect(os.path.join(directory, name))
+        self.connection.execute('CREATE TABLE IF NOT EXISTS fingerprints ('
+                                'path TEXT PRIMARY KEY, size INTEGER, mtime INTEGER, partial TEXT, full TEXT)')
+        # path => [size, mtime, partial, full], the hashes are None until they were needed
+        self.entries = {}
+        for path, size, mtime, partial, full in self.connection.execute('SELECT path, size, mtime, partial, full FROM fingerprints'):
+            self.entries[path] = [size, mtime, partial, full]
+        self.changed = set()
+        self.removed = set()
+
+    # update the entry of path from the file at location, returns False if there is no such file
+    def refresh(self, path, location):
+        try:
+            stat = os.stat(location)
+        except OSError:
+            if self.entries.pop(path, None) is not None:
+                self.removed.add(path)
+            return False
+        entry = self.entries.get(path)
+        if entry is None or entry[SIZE] != stat.st_size or entry[MTIME] != stat.st_mtime_ns:
+            self.entries[path] = [stat.st_size, stat.st_mtime_ns, None, None]
+            self.changed.add(path)
+            self.removed.discard(path)
+        return True
+
+    def hash(self, path, location, field):
+        entry = self.entries[path]
+        if entry[field] is None:
+            entry[field] = partial_hash(location, entry[SIZE]) if field == PARTIAL else r2j_archive.checksum(location)
+            self.changed.add(path)
+        return entry[field]
+
+    # split (path, location) members into groups with the same hash, groups of one are left out
+    def split(self, members, field):
+        groups = {}
+        for path, location in members:
+            try:
+                groups.setdefault(self.hash(path, location, field), []).append((path, location))
+            except OSError:
+                # unreadable, the conversion or transfer will report it
+                pass
+        return [group for group in groups.values() if len(group) > 1]
+
+    # find the candidates that have the same content as another candidate or an earlier file
+    # source(path) and stored(path) give the locations of candidates and earlier files (by default both are source)
+    # earlier files only count if done(path) is True, known are files of this run that are already done
+    # returns path => original for every duplicate, originals are earlier files or the first candidate in order
+    def find_duplicates(self, candidates, source, stored=None, done=None, known=()):
+        stored = stored or source
+        for path in known:
+            self.refresh(path, stored(path))
+        candidates = [path for path in candidates if self.refresh(path, source(path))]
+        is_candidate = set(candidates)
+        new = {}
+        for path in candidates:
+            new.setdefault(self.entries[path][SIZE], []).append(path)
+        earlier = {}
+        for path, entry in self.entries.items():
+            if entry[SIZE] in new and path not in is_candidate:
+                earlier.setdefault(entry[SIZE], []).append(path)
+
+        duplicates = {}
+        for size, paths in new.items():
+            members = []
+            for path in sorted(earlier.get(size, [])):
+                if self.refresh(path, stored(path)) and self.entries[path][SIZE] == size and (done is None or done(path)):
+                    members.append((path, stored(path)))
+            members += [(path, source(path)) for path in paths]
+            if len(members) < 2:
+                continue
+            for group in self.split(members, PARTIAL):
+                for group in self.split(group, FULL):
+                    original = group[0][0]
+                    for path, location in group[1:]:
+                        if path in is_candidate:
+                            duplicates[path] = original
+        self.commit()
+        return duplicates
+
+    def commit(self):
+        self.connection.executemany('INSERT OR REPLACE INTO fingerprints VALUES (?, ?, ?, ?, ?)',
+                                    [[path] + self.entries[path] for path in self.changed if path in self.entries])
+        self.connection.executemany('DELETE FROM fingerprints WHERE path = ?', [(path,) for path in self.removed])
+        self.connection.commit()
+        self.changed = set()
+        self.removed = set()
+
+    def close(self):
+        self.commit()
+        self.connection.close()
@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+
+# Encoder settings of the output formats
+# Settings are a dict with the jpeg and webp quality, the jpeg options optimize
+# (extra huffman pass), progressive and subsampling, the webp method (effort
+# from 0 to 6) and the tiff compression. Presets give the starting values,
+# single settings can be overridden on top.
+#
+# The fast preset skips the huffman optimization of jpegs, which makes
+# encoding about three times faster for files a few percent larger, and uses
+# webp method 2, several times faster than the default (methods 0 and 1 fail
+# on large images with libwebp). See the encode scenario of benchmarks/benchmark.py.
+
+import argparse
+
+
+PRESETS = {
+    'default': dict(quality=90, optimize=True, progressive=False, subsampling='4:2:0', method=4, compression='none'),
+    'fast': dict(quality=90, optimize=False, progressive=False, subsampling='4:2:0', method=2, compression='none'),
+    'small': dict(quality=85, optimize=True, progressive=True, subsampling='4:2:0', method=6, compression='deflate'),
+}
+
+# chroma subsampling => PIL value
+SUBSAMPLING = { '4:4:4': 0, '4:2:2': 1, '4:2:0': 2 }
+
+# tiff compression => PIL value
+COMPRESSIONS = { 'none': None, 'deflate': 'tiff_deflate' }
+
+# settings that affect the files of a format
+FORMAT_SETTINGS = {
+    'jpg': ('quality', 'optimize', 'progressive', 'subsampling'),
+    'webp': ('quality', 'method'),
+    'tiff': ('compression',),
+    'tiff16': ('compression',),
+}
+
+
+# settings of a preset with the given (not None) settings replaced
+def encoder_settings(preset='default', **overrides):
+    if preset not in PRESETS:
+        raise ValueError('unknown preset ' + str(preset) + ', expected one of ' + ', '.join(PRESETS))
+    settings = dict(PRESETS[preset])
+    for key, value in overrides.items():
+        if key not in settings:
+            raise ValueError('unknown encoder setting ' + key)
+        if value is not None:
+            settings[key] = value
+    if not 1 <= settings['quality'] <= 100:
+        raise ValueError('quality must be between 1 and 100')
+    if settings['subsampling'] not in SUBSAMPLING:
+        raise ValueError('subsampling must be one of ' + ', '.join(SUBSAMPLING))
+    if settings['compression'] not in COMPRESSIONS:
+        raise ValueError('compression must be one of ' + ', '.join(COMPRESSIONS))
+    return settings
+
+
+# the part of the settings that is used for a format
+def format_settings(settings, fmt):
+    return dict((key, settings[key]) for key in FORMAT_SETTINGS[fmt])
+
+
+# argparse type for the quality
+def parse_quality(spec):
+    try:
+        quality = int(spec)
+    except ValueError:
+        quality = 0
+    if not 1 <= quality <= 100:
+        raise argparse.ArgumentTypeError('expected a number between 1 and 100')
+    return quality
+
+
+# write a rendered image (see r2j_renditions.render) to the binary file f
+def encode_image(rendered, fmt, f, settings=None):
+    import numpy
+    import r2j_tiff
+    settings = settings or PRESETS['default']
+    if isinstance(rendered, bytes):
+        # embedded jpegs are written as they are
+        f.write(rendered)
+    elif isinstance(rendered, numpy.ndarray):
+        r2j_tiff.write_tiff16(f, rendered, compression=settings['compression'])
+    elif fmt == 'tiff':
+        rendered.save(f, format='TIFF', compression=COMPRESSIONS[settings['compression']])
+    elif fmt == 'webp':
+        rendered.save(f, format='WEBP', quality=settings['quality'], method=settings['method'])
+    else:
+        rendered.save(f, format='JPEG', quality=settings['quality'], optimize=settings['optimize'],
+                      progressive=settings['progressive'], subsampling=SUBSAMPLING[settings['subsampling']])
@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+
+# Minimal reader for the camera tags of tiff based raw files (CR2, NEF, DNG, ...)
+# libraw does not expose make, model and serial number through rawpy, and
+# decoding the whole file just to identify the camera would be wasteful.
+
+import struct
+
+
+MAKE = 271
+MODEL = 272
+ORIENTATION = 274
+EXIF_IFD = 34665
+BODY_SERIAL_NUMBER = 42033
+CAMERA_SERIAL_NUMBER = 50735
+
+TYPE_SIZES = { 1: 1, 2: 1, 3: 2, 4: 4, 5: 8, 7: 1, 9: 4, 10: 8 }
+
+# exif orientation of the flip values of libraw (raw.sizes.flip)
+FLIP_ORIENTATION = { 3: 3, 5: 8, 6: 6 }
+
+
+def read_ifd(f, order, offset, wanted):
+    values = {}
+    f.seek(offset)
+    count = struct.unpack(order + 'H', f.read(2))[0]
+    entries = [struct.unpack(order + 'HHI4s', f.read(12)) for _ in range(count)]
+    for tag, typ, count, value in entries:
+        if tag not in wanted or typ not in TYPE_SIZES:
+            continue
+        size = TYPE_SIZES[typ] * count
+        if size > 4:
+            f.seek(struct.unpack(order + 'I', value)[0])
+            value = f.read(size)
+        if typ == 2:
+            values[tag] = value[:size].split(b'\0')[0].decode('ascii', 'replace').strip()
+        elif typ == 4:
+            values[tag] = struct.unpack(order + 'I', value[:4])[0]
+    return values
+
+
+# insert an exif segment holding only the orientation into a jpeg, right behind SOI (and JFIF)
+# readers use the first exif segment, so it takes precedence over one the camera wrote further back
+def add_orientation(jpeg, orientation):
+    tiff = b'MM\0*' + struct.pack('>IH', 8, 1) + struct.pack('>HHIHH', ORIENTATION, 3, 1, orientation, 0) + struct.pack('>I', 0)
+    segment = b'Exif\0\0' + tiff
+    position = 2
+    if jpeg[2:4] == b'\xff\xe0':
+        position += 2 + struct.unpack('>H', jpeg[4:6])[0]
+    return jpeg[:position] + b'\xff\xe1' + struct.pack('>H', len(segment) + 2) + segment + jpeg[position:]
+
+
+# returns a dict with make, model and serial (empty strings if unknown)
+def read_camera_tags(path):
+    tags = {}
+    try:
+        with open(path, 'rb') as f:
+            header = f.read(8)
+            if header[:2] not in (b'II', b'MM'):
+                raise ValueError('not a tiff based raw file')
+            order = '<' if header[:2] == b'II' else '>'
+            ifd_offset = struct.unpack(order + 'I', header[4:8])[0]
+            tags = read_ifd(f, order, ifd_offset, (MAKE, MODEL, EXIF_IFD, CAMERA_SERIAL_NUMBER))
+            if EXIF_IFD in tags:
+                tags.update(read_ifd(f, order, tags[EXIF_IFD], (BODY_SERIAL_NUMBER,)))
+    except (OSError, ValueError, struct.error):
+        pass
+    return dict(make=tags.get(MAKE, ''), model=tags.get(MODEL, ''),
+                serial=tags.get(BODY_SERIAL_NUMBER, tags.get(CAMERA_SERIAL_NUMBER, '')))
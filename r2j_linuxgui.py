@@ -4,13 +4,24 @@
 import gi
 gi.require_version('Gtk', '3.0')
 from gi.repository import Gtk, GLib
-from threading import Thread
+from threading import Lock, Thread
+import collections
+import datetime
 import io
 import os
 import signal
 import subprocess
 import time
 
+import r2j_progress
+
+
+# milliseconds between updates of the log and the progress bar
+UPDATE_INTERVAL = 200
+
+# lines kept in the log, older ones are dropped
+MAX_LOG_LINES = 5000
+
 
 arguments = {
     '--copy' : 'copies all RAW-files (recursive, maintains folder structure)',
@@ -32,7 +43,11 @@ class Application(Gtk.Window):
         self.connect('delete-event', quit_application)
 
         self.input_path = self.output_path = None
-        self.output_buffer = ''
+        # output of the subprocess that is not shown yet, written by its reader thread
+        self.log_lines = collections.deque(maxlen=MAX_LOG_LINES)
+        self.log_lock = Lock()
+        self.tracker = r2j_progress.Tracker()
+        self.running = False
         self.binpath = binpath
         self.subproc = None
 
@@ -51,6 +66,7 @@ class Application(Gtk.Window):
         self.ctrl_button_box = Gtk.Box(spacing=5)
         self.flag_box = Gtk.FlowBox()
         self.create_flag_box()
+        self.progress_bar = Gtk.ProgressBar()
         self.output_view = Gtk.TextView()
         self.scrolled_window = Gtk.ScrolledWindow()
 
@@ -62,6 +78,10 @@ class Application(Gtk.Window):
         self.output_view.set_editable(False)
         self.output_view.set_cursor_visible(False)
         self.output_view_buffer = self.output_view.get_buffer()
+        # stays at the end when text is inserted
+        self.end_mark = self.output_view_buffer.create_mark(None, self.output_view_buffer.get_end_iter(), False)
+        self.progress_bar.set_show_text(True)
+        self.progress_bar.set_text('(No process running)')
         self.output_view.set_top_margin(5)
         self.output_view.set_right_margin(5)
         self.output_view.set_bottom_margin(5)
@@ -83,6 +103,7 @@ class Application(Gtk.Window):
         self.main_box.add(self.file_button_box)
         self.main_box.add(self.flag_box)
         self.main_box.add(self.ctrl_button_box)
+        self.main_box.add(self.progress_bar)
         self.main_box.add(self.scrolled_window)
         self.add(self.main_box)
 
@@ -118,18 +139,34 @@ class Application(Gtk.Window):
                 arguments.append(self.checkboxes[checkbox])
         return arguments
 
+    # runs in the main loop before the subprocess is started
+    def start_run(self):
+        self.output_view_buffer.set_text('')
+        with self.log_lock:
+            self.log_lines.clear()
+        self.tracker = r2j_progress.Tracker()
+        self.progress_bar.set_fraction(0)
+        self.progress_bar.set_text('Collecting files...')
+        self.running = True
+        GLib.timeout_add(UPDATE_INTERVAL, self.update_view)
+
     def open_subprocess(self):
-        self.output_buffer = ''
         args = [ self.input_path, self.output_path ] + self.get_arguments()
         # Update abort button
         GLib.idle_add(self.abort_button.set_label, 'Abort process')
         print('New subproc with args: {}'.format(args))
 
-        self.subproc = subprocess.Popen(['python', '-u', self.binpath] + args, stdout=subprocess.PIPE)
-        for line in io.TextIOWrapper(self.subproc.stdout, encoding='ascii'):
+        # progress events come through a pipe of their own (see r2j_progress)
+        progress_read, progress_write = os.pipe()
+        # file names are not always ascii
+        env = dict(os.environ, PYTHONIOENCODING='utf-8:surrogateescape')
+        self.subproc = subprocess.Popen(['python', '-u', self.binpath] + args + ['--progress', '/dev/fd/{}'.format(progress_write)],
+                                        stdout=subprocess.PIPE, pass_fds=(progress_write,), env=env)
+        os.close(progress_write)
+        Thread(target=self.read_progress, args=(progress_read, self.tracker), daemon=True).start()
+        for line in io.TextIOWrapper(self.subproc.stdout, encoding='utf-8', errors='replace'):
             print(line.replace('\n', ''))
-            self.output_buffer += line
-            GLib.idle_add(self.output_view_buffer.set_text, self.output_buffer)
+            self.append_log(line)
 
         self.subproc.poll()
         # Sometimes the returncode is not available right away
@@ -137,13 +174,58 @@ class Application(Gtk.Window):
             self.subproc.poll()
             time.sleep(0.5)
         if self.subproc.returncode != 0:
-            self.output_buffer += '\nSubprocess returned with error ({})'.format(self.subproc.returncode)
-            GLib.idle_add(self.output_view_buffer.set_text, self.output_buffer)
+            self.append_log('\nSubprocess returned with error ({})'.format(self.subproc.returncode))
         else:
-            self.output_buffer += '\n\n\t(Subprocess finished without errors)'
-            GLib.idle_add(self.output_view_buffer.set_text, self.output_buffer)
+            self.append_log('\n\n\t(Subprocess finished without errors)')
+        self.running = False
         GLib.idle_add(self.abort_button.set_label, '(No process running)')
 
+    def read_progress(self, fd, tracker):
+        with io.open(fd, encoding='utf-8', errors='replace') as f:
+            for line in f:
+                tracker.feed(line)
+
+    # the text view is only touched in update_view, a line at a time would block the main loop on large runs
+    def append_log(self, text):
+        with self.log_lock:
+            self.log_lines.append(text)
+
+    # runs in the main loop every UPDATE_INTERVAL while a subprocess is running
+    def update_view(self):
+        # read before taking the lines, so the last output is shown before the timer stops
+        running = self.running
+        with self.log_lock:
+            text = ''.join(self.log_lines)
+            self.log_lines.clear()
+        if text:
+            self.output_view_buffer.insert(self.output_view_buffer.get_end_iter(), text)
+            excess = self.output_view_buffer.get_line_count() - MAX_LOG_LINES
+            if excess > 0:
+                self.output_view_buffer.delete(self.output_view_buffer.get_start_iter(), self.output_view_buffer.get_iter_at_line(excess))
+            self.output_view.scroll_mark_onscreen(self.end_mark)
+        self.update_progress(running)
+        return running
+
+    def update_progress(self, running):
+        done, total, failed, rate, eta = self.tracker.status()
+        if total == 0:
+            if running:
+                # the files are still being collected
+                self.progress_bar.pulse()
+            else:
+                self.progress_bar.set_fraction(0)
+                self.progress_bar.set_text('No files converted')
+            return
+        self.progress_bar.set_fraction(min(done / total, 1.0))
+        text = '{} of {} files'.format(done, total)
+        if failed > 0:
+            text += ', {} failed'.format(failed)
+        if running and rate > 0:
+            text += ', {:.1f} files/s'.format(rate)
+            if eta is not None:
+                text += ', {} remaining'.format(datetime.timedelta(seconds=round(eta)))
+        self.progress_bar.set_text(text)
+
     def error_dialog(self, text, secondary_text):
         dialog = Gtk.MessageDialog(
             transient_for=self,
@@ -177,7 +259,10 @@ class Application(Gtk.Window):
             elif self.output_path == None \
                     or not os.path.isdir(self.output_path):
                 self.error_dialog('No output path', 'You have to select a directory where the converted files can go.')
+            elif self.running:
+                self.error_dialog('Process running', 'Wait for the running process to finish or abort it first.')
             else:
+                self.start_run()
                 Thread(target=self.open_subprocess).start()
         elif source == self.abort_button:
             if not self.subproc == None and self.subproc.returncode == None:
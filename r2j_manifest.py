@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+
+# Persistent record of finished conversions
+# The manifest is a sqlite database in the destination folder. A raw file
+# counts as done if its size, mtime and the fingerprint of the conversion
+# settings match the recorded entry, so re-runs only touch new or changed
+# files and never have to stat the destination.
+
+import hashlib
+import json
+import os
+import sqlite3
+
+
+MANIFEST_NAME = '.raw-to-jpg.sqlite'
+
+
+def settings_fingerprint(settings):
+    return hashlib.sha1(json.dumps(settings, sort_keys=True).encode()).hexdigest()
+
+
+class Manifest:
+    def __init__(self, directory, commit_interval=100, name=MANIFEST_NAME):
+        if not os.path.isdir(directory):
+            os.makedirs(directory, exist_ok=True)
+        self.connection = sqlite3.connect(os.path.join(directory, name))
+        self.connection.execute('CREATE TABLE IF NOT EXISTS conversions ('
+                                'source TEXT PRIMARY KEY, size INTEGER, mtime INTEGER, settings TEXT, output TEXT)')
+        self.connection.execute('CREATE TABLE IF NOT EXISTS folders ('
+                                'path TEXT PRIMARY KEY, mtime INTEGER, settings TEXT, subfolders TEXT)')
+        self.commit_interval = commit_interval
+        self.uncommitted = 0
+        # loading everything at once is much cheaper than one query per file
+        self.entries = {}
+        for source, size, mtime, settings in self.connection.execute('SELECT source, size, mtime, settings FROM conversions'):
+            self.entries[source] = (size, mtime, settings)
+        # source folders of the last run, see r2j_scan
+        self.folders = {}
+        for path, mtime, settings, subfolders in self.connection.execute('SELECT path, mtime, settings, subfolders FROM folders'):
+            self.folders[path] = (mtime, settings, json.loads(subfolders))
+
+    def __contains__(self, source):
+        return source in self.entries
+
+    def is_current(self, source, size, mtime, settings):
+        return self.entries.get(source) == (size, mtime, settings)
+
+    def record(self, source, size, mtime, settings, output):
+        self.entries[source] = (size, mtime, settings)
+        self.connection.execute('INSERT OR REPLACE INTO conversions VALUES (?, ?, ?, ?, ?)',
+                                (source, size, mtime, settings, output))
+        self.uncommitted += 1
+        if self.uncommitted >= self.commit_interval:
+            self.commit()
+
+    def record_folder(self, path, mtime, settings, subfolders):
+        self.folders[path] = (mtime, settings, subfolders)
+        self.connection.execute('INSERT OR REPLACE INTO folders VALUES (?, ?, ?, ?)',
+                                (path, mtime, settings, json.dumps(subfolders)))
+
+    def commit(self):
+        self.connection.commit()
+        self.uncommitted = 0
+
+    def close(self):
+        self.commit()
+        self.connection.close()
@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+
+# Streaming pipeline for the conversion stages
+# Every stage runs in its own thread and hands its results to the next stage
+# through a bounded queue, so a slow stage blocks the ones in front of it
+# instead of letting them pile up decoded images in memory.
+
+import queue
+import threading
+
+
+_END = object()
+
+
+# the input iterator raised, the error is handed to the consumer instead of _END
+class _Abort:
+    def __init__(self, error):
+        self.error = error
+
+
+# a stage is a function (item, value) -> value
+# returning None drops the item from the remaining stages (e.g. skipped files)
+def run_pipeline(items, stages, queue_size=2):
+    stop = threading.Event()
+    queues = [queue.Queue(maxsize=queue_size) for _ in range(len(stages) + 1)]
+
+    def put(q, entry):
+        # give up when the consumer went away, otherwise we would block forever
+        while not stop.is_set():
+            try:
+                q.put(entry, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def get(q):
+        while not stop.is_set():
+            try:
+                return q.get(timeout=0.1)
+            except queue.Empty:
+                pass
+        return _END
+
+    def feed():
+        try:
+            for item in items:
+                if not put(queues[0], (item, True, None)):
+                    return
+        except BaseException as e:
+            put(queues[0], _Abort(e))
+            return
+        put(queues[0], _END)
+
+    def work(stage, in_queue, out_queue):
+        while True:
+            entry = get(in_queue)
+            if entry is _END or isinstance(entry, _Abort):
+                put(out_queue, entry)
+                return
+            item, value, error = entry
+            if error is None and value is not None:
+                try:
+                    value = stage(item, value)
+                except Exception as e:
+                    value, error = None, e
+            if not put(out_queue, (item, value, error)):
+                return
+
+    threads = [threading.Thread(target=feed, daemon=True)]
+    for i, stage in enumerate(stages):
+        threads.append(threading.Thread(target=work, args=(stage, queues[i], queues[i + 1]), daemon=True))
+    for thread in threads:
+        thread.start()
+
+    # yields (item, result, error) in input order; result is None for dropped items
+    # an error of the input iterator is raised here once the items before it are done
+    try:
+        while True:
+            entry = queues[-1].get()
+            if entry is _END:
+                return
+            if isinstance(entry, _Abort):
+                raise entry.error
+            yield entry
+    finally:
+        stop.set()
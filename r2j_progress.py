@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+
+# Machine readable progress stream (--progress)
+# The converter writes one json object per line as soon as something happens:
+#   {"event": "queued", "files": 120, "skipped": 20}  120 more files, 20 of them were up to date already
+#   {"event": "file", "path": "/a/IMG_1.CR2", "status": "done"}  status is done, failed or skipped
+#   {"event": "finished"}
+# Frontends (like r2j_linuxgui) follow the stream with a Tracker instead of
+# parsing the printed output.
+
+import collections
+import json
+import threading
+import time
+
+
+# seconds over which the rate is averaged
+RATE_WINDOW = 30
+
+
+class Progress:
+    # path is usually a pipe of the frontend, e.g. /dev/fd/3
+    def __init__(self, path):
+        self.file = open(path, 'w', buffering=1, encoding='utf-8')
+        # archive transfers report from several threads
+        self.lock = threading.Lock()
+
+    def write(self, **event):
+        with self.lock:
+            if self.file is None:
+                return
+            try:
+                self.file.write(json.dumps(event) + '\n')
+            except OSError:
+                # the frontend is gone, that must not stop the conversion
+                self.file = None
+
+    def queued(self, files, skipped=0):
+        self.write(event='queued', files=files, skipped=skipped)
+
+    def file_done(self, path, status='done'):
+        self.write(event='file', path=path, status=status)
+
+    def close(self):
+        self.write(event='finished')
+        with self.lock:
+            if self.file is not None:
+                try:
+                    self.file.close()
+                except OSError:
+                    pass
+                self.file = None
+
+
+class Tracker:
+    def __init__(self, window=RATE_WINDOW):
+        self.window = window
+        self.total = 0
+        self.done = 0
+        self.failed = 0
+        self.finished = False
+        # files that were converted or copied (not skipped), for the rate
+        self.worked = 0
+        # (time, worked) over the last window seconds
+        self.samples = collections.deque()
+        self.lock = threading.Lock()
+
+    # read one line of the stream, anything that is not an event is ignored
+    def feed(self, line):
+        try:
+            event = json.loads(line)
+        except ValueError:
+            return
+        if not isinstance(event, dict):
+            return
+        now = time.monotonic()
+        with self.lock:
+            if event.get('event') == 'queued':
+                self.total += event.get('files', 0)
+                self.done += event.get('skipped', 0)
+                if len(self.samples) == 0:
+                    self.samples.append((now, self.worked))
+            elif event.get('event') == 'file':
+                self.done += 1
+                if event.get('status') == 'failed':
+                    self.failed += 1
+                if event.get('status') != 'skipped':
+                    self.worked += 1
+                    self.samples.append((now, self.worked))
+            elif event.get('event') == 'finished':
+                self.finished = True
+
+    # returns done, total (0 while the files are collected), failed, files per second and the remaining seconds (or None)
+    def status(self):
+        now = time.monotonic()
+        with self.lock:
+            while len(self.samples) > 1 and self.samples[0][0] < now - self.window:
+                self.samples.popleft()
+            rate = 0.0
+            if len(self.samples) > 0 and now > self.samples[0][0]:
+                rate = (self.worked - self.samples[0][1]) / (now - self.samples[0][0])
+            eta = (self.total - self.done) / rate if rate > 0 else None
+            return self.done, self.total, self.failed, rate, eta
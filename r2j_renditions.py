@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+
+# Several output images (renditions) from a single raw decode
+# A rendition is a tuple (name, format, size). The name is the subfolder of
+# the destination the rendition goes into ('' for the destination itself),
+# size is the maximum edge length in pixels (None keeps the full resolution).
+# numpy and PIL are only imported once images are rendered, parsing the
+# command line must not load them.
+
+import argparse
+import io
+import sys
+
+
+# format => file ending
+FORMATS = { 'jpg': '.jpg', 'webp': '.webp', 'tiff': '.tiff', 'tiff16': '.tiff' }
+
+
+# argparse type for NAME:FORMAT[:SIZE]
+def parse_rendition(spec):
+    parts = spec.split(':')
+    if len(parts) not in (2, 3) or parts[1] not in FORMATS:
+        raise argparse.ArgumentTypeError('expected NAME:FORMAT[:SIZE] with FORMAT one of ' + ', '.join(FORMATS))
+    name = parts[0].strip('/')
+    if name == '.':
+        name = ''
+    if '..' in name.split('/'):
+        raise argparse.ArgumentTypeError('NAME must stay inside the destination (no ..)')
+    try:
+        size = int(parts[2]) if len(parts) == 3 else None
+    except ValueError:
+        raise argparse.ArgumentTypeError('size must be a number of pixels')
+    if size is not None and size <= 0:
+        raise argparse.ArgumentTypeError('size must be at least one pixel')
+    return (name, parts[1], size)
+
+
+def default_rendition(tiff=False):
+    return ('', 'tiff' if tiff else 'jpg', None)
+
+
+def needs_16_bit(renditions):
+    return any(rendition[1] == 'tiff16' for rendition in renditions)
+
+
+# embedded preview as PIL image, turned upright by its exif orientation
+def open_jpeg(data):
+    from PIL import Image, ImageOps
+    image = Image.open(io.BytesIO(data))
+    image.load()
+    return ImageOps.exif_transpose(image)
+
+
+# scale so the longer edge is at most size, never enlarge
+def target_size(width, height, size):
+    if size is None or max(width, height) <= size:
+        return width, height
+    scale = size / max(width, height)
+    return max(1, round(width * scale)), max(1, round(height * scale))
+
+
+def resize_8_bit(image, size):
+    from PIL import Image
+    new_size = target_size(image.width, image.height, size)
+    if new_size == image.size:
+        return image
+    # reducing_gap lets PIL shrink by an integer factor first, which is much faster for big steps
+    return image.resize(new_size, Image.Resampling.LANCZOS, reducing_gap=2.0)
+
+
+def resize_16_bit(rgb, size):
+    import numpy
+    from PIL import Image
+    height, width = rgb.shape[:2]
+    new_size = target_size(width, height, size)
+    if new_size == (width, height):
+        return rgb
+    # PIL only knows single channel 16 bit images
+    channels = [numpy.asarray(Image.fromarray(numpy.ascontiguousarray(rgb[:, :, c])).resize(new_size, Image.Resampling.LANCZOS, reducing_gap=2.0))
+                for c in range(3)]
+    return numpy.dstack(channels)
+
+
+# yields (rendition, image) for every rendition
+# image is either an 8 or 16 bit rgb array or an encoded jpeg (embedded preview)
+# the result is a PIL image, a 16 bit rgb array (tiff16) or the unchanged jpeg bytes
+# renditions are produced from large to small, each one resampled from the previous one
+def render(image, renditions):
+    import numpy
+    from PIL import Image
+    image_8_bit = image_16_bit = None
+    for rendition in sorted(renditions, key=lambda rendition: -(rendition[2] or sys.maxsize)):
+        name, fmt, size = rendition
+        if fmt == 'tiff16':
+            if image_16_bit is None:
+                if isinstance(image, bytes):
+                    image_16_bit = numpy.asarray(open_jpeg(image).convert('RGB')).astype(numpy.uint16) * 257
+                elif image.dtype == numpy.uint8:
+                    image_16_bit = image.astype(numpy.uint16) * 257
+                else:
+                    image_16_bit = image
+            image_16_bit = resize_16_bit(image_16_bit, size)
+            yield rendition, image_16_bit
+        elif isinstance(image, bytes) and fmt == 'jpg' and size is None:
+            yield rendition, image
+        else:
+            if image_8_bit is None:
+                if isinstance(image, bytes):
+                    image_8_bit = open_jpeg(image)
+                elif image.dtype == numpy.uint16:
+                    image_8_bit = Image.fromarray((image >> 8).astype(numpy.uint8))
+                else:
+                    image_8_bit = Image.fromarray(image)
+            image_8_bit = resize_8_bit(image_8_bit, size)
+            yield rendition, image_8_bit
+
@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+
+# Per file timing instrumentation and a machine readable run report
+# Every converted or copied file gets a record with the duration of each stage,
+# the bytes read and written and (for raws) the megapixels and camera model.
+# The report is a json lines file: one event per file, followed by a summary
+# with totals, megapixels per second and per camera histograms.
+
+import contextlib
+import json
+import threading
+import time
+
+
+# upper bounds (seconds per file) of the histogram buckets
+HISTOGRAM_BUCKETS = ( 0.1, 0.25, 0.5, 1, 2, 4, 8, 16, 32, 64 )
+
+
+def new_record(path, kind='convert'):
+    return { 'path': path, 'kind': kind, 'camera': '', 'stages': {}, 'bytes_read': 0, 'bytes_written': 0, 'megapixels': 0.0 }
+
+
+# measure a stage, does nothing if record is None
+@contextlib.contextmanager
+def stage(record, name):
+    if record is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record['stages'][name] = record['stages'].get(name, 0.0) + time.perf_counter() - start
+
+
+def histogram(durations):
+    counts = [0] * (len(HISTOGRAM_BUCKETS) + 1)
+    for duration in durations:
+        bucket = 0
+        while bucket < len(HISTOGRAM_BUCKETS) and duration > HISTOGRAM_BUCKETS[bucket]:
+            bucket += 1
+        counts[bucket] += 1
+    labels = ['<=' + str(bound) for bound in HISTOGRAM_BUCKETS] + ['>' + str(HISTOGRAM_BUCKETS[-1])]
+    return dict(zip(labels, counts))
+
+
+class Report:
+    def __init__(self, path):
+        self.file = open(path, 'w')
+        self.start = time.perf_counter()
+        self.records = []
+        # archive transfers report from several threads
+        self.lock = threading.Lock()
+
+    def add(self, record):
+        record = dict(record, event='file', seconds=sum(record['stages'].values()))
+        with self.lock:
+            self.records.append(record)
+            self.file.write(json.dumps(record) + '\n')
+
+    def summary(self):
+        wall_time = time.perf_counter() - self.start
+        stages = {}
+        for record in self.records:
+            for name, duration in record['stages'].items():
+                stages[name] = stages.get(name, 0.0) + duration
+        megapixels = sum(record['megapixels'] for record in self.records)
+        cameras = {}
+        for record in self.records:
+            if record['kind'] == 'convert':
+                cameras.setdefault(record['camera'] or 'unknown', []).append(record)
+        return {
+            'event': 'summary',
+            'wall_seconds': wall_time,
+            'files': len(self.records),
+            'stage_seconds': stages,
+            'bytes_read': sum(record['bytes_read'] for record in self.records),
+            'bytes_written': sum(record['bytes_written'] for record in self.records),
+            'megapixels': megapixels,
+            'megapixels_per_second': megapixels / wall_time if wall_time > 0 else 0.0,
+            'cameras': dict((camera, {
+                'files': len(records),
+                'megapixels': sum(record['megapixels'] for record in records),
+                # processing throughput of a single file, independent of the number of workers
+                'megapixels_per_second': sum(record['megapixels'] for record in records) / max(sum(record['seconds'] for record in records), 1e-9),
+                'seconds_histogram': histogram(record['seconds'] for record in records),
+            }) for camera, records in cameras.items()),
+        }
+
+    def close(self):
+        self.file.write(json.dumps(self.summary()) + '\n')
+        self.file.close()
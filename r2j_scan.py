@@ -0,0 +1,51 @@
+#!/usr/bin/env python3
+
+# Single pass directory walker shared by all modes
+# Uses os.scandir, so the file type of every entry comes from the directory
+# listing itself instead of separate isdir/isfile calls.
+# With the folder state of the last run a folder whose mtime did not change is
+# not listed again. Only its subfolders (remembered from the last run) are
+# checked, so whole unchanged subtrees cost one stat per folder.
+
+import os
+
+
+class Scanner:
+    # folders: dict path => (mtime, settings, subfolders) of the last run or None to scan everything
+    # settings: fingerprint of the current settings, folders scanned with other settings are listed again
+    def __init__(self, in_path, recursion=True, folders=None, settings=None):
+        self.in_path = in_path
+        self.recursion = recursion
+        self.folders = folders
+        self.settings = settings
+        # path => (mtime, subfolders) of every folder listed in this run
+        self.scanned = {}
+
+    # yields (folder, files) in sorted order, files is a list of (path, DirEntry) of the regular files
+    # files is None for folders that are unchanged since the last run
+    def walk(self, path):
+        if not str.endswith(path, '/') or path == '':
+            path += '/'
+        mtime = os.stat(self.in_path + path).st_mtime_ns
+        last = self.folders.get(path) if self.folders is not None else None
+        if last is not None and last[0] == mtime and last[1] == self.settings:
+            yield path, None
+            subfolders = last[2] if self.recursion else []
+            for name in subfolders:
+                if os.path.isdir(self.in_path + path + name):
+                    yield from self.walk(path + name)
+            return
+
+        files = []
+        subfolders = []
+        with os.scandir(self.in_path + path) as entries:
+            for entry in sorted(entries, key=lambda entry: entry.name):
+                if entry.is_dir():
+                    subfolders.append(entry.name)
+                elif entry.is_file():
+                    files.append((path + entry.name, entry))
+        self.scanned[path] = (mtime, subfolders)
+        yield path, files
+        if self.recursion:
+            for name in subfolders:
+                yield from self.walk(path + name)
@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+
+# Memory aware scheduling of conversions in the process pool
+# Decoding a 45-60MP raw needs hundreds of megabytes. Every job gets a memory
+# estimate from the raw dimensions (libraw reads them from the header without
+# decoding) and is only started while the estimates of all running jobs fit
+# into the budget. Jobs are started largest first, so a big file does not end
+# up running alone at the end of the batch.
+# A worker that dies (e.g. killed by the oom killer) breaks the whole process
+# pool, the jobs that were running fail and the pool is started again.
+
+import argparse
+import os
+from concurrent.futures import wait, FIRST_COMPLETED
+
+
+UNITS = { 'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3, 'T': 1024 ** 4 }
+
+# used for files libraw can not read the header of
+FALLBACK_FACTOR = 20
+
+
+# argparse type for sizes like 512M or 16G
+def parse_memory(spec):
+    spec = spec.strip().upper().rstrip('B')
+    try:
+        if spec and spec[-1] in UNITS:
+            return int(float(spec[:-1]) * UNITS[spec[-1]])
+        return int(spec)
+    except ValueError:
+        raise argparse.ArgumentTypeError('expected a size like 512M or 16G')
+
+
+# three quarters of the physical memory
+def default_budget():
+    try:
+        return os.sysconf('SC_PHYS_PAGES') * os.sysconf('SC_PAGE_SIZE') * 3 // 4
+    except (ValueError, OSError, AttributeError):
+        return 4 * UNITS['G']
+
+
+# peak memory of converting a raw file in bytes
+def estimate_memory(path, half_size=False, output_bps=8):
+    import rawpy
+    file_size = os.path.getsize(path)
+    raw = rawpy.RawPy()
+    try:
+        raw.open_file(path)
+        sizes = raw.sizes
+    except rawpy.LibRawError:
+        return file_size * FALLBACK_FACTOR
+    finally:
+        raw.close()
+    pixels = sizes.width * sizes.height
+    if half_size:
+        pixels //= 4
+    # raw data (16 bit), libraw's 4 channel 16 bit working image,
+    # the rgb array and the copy PIL makes of it for encoding
+    return (file_size + sizes.raw_width * sizes.raw_height * 2 + sizes.iwidth * sizes.iheight * 8
+            + pixels * 3 * (output_bps // 8) * 2)
+
+
+# process pool with spawned workers that can be started again after a worker died
+class Pool:
+    def __init__(self, workers):
+        self.workers = workers
+        self.executor = None
+        self.restart()
+
+    def restart(self):
+        import multiprocessing
+        from concurrent.futures import ProcessPoolExecutor
+        if self.executor is not None:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+        self.executor = ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context('spawn'))
+
+    def submit(self, function, *args):
+        return self.executor.submit(function, *args)
+
+    def shutdown(self):
+        self.executor.shutdown(cancel_futures=True)
+
+
+# runs function(item) in the pool and yields (item, result, error) as soon as each item is done
+# error is the exception of a job whose worker died, result is None then
+# costs are the memory estimates of the items, budget the limit for their sum
+# claim(item) is called right before an item is started, items it returns False for
+# are skipped and yielded with the result None
+def run_scheduled(pool, function, items, costs, budget, workers, claim=None):
+    from concurrent.futures.process import BrokenProcessPool
+    # largest first
+    queue = sorted(range(len(items)), key=lambda i: -costs[i])
+    # future => index
+    running = {}
+    in_use = 0
+    while queue or running:
+        # start the largest jobs that fit, one job is always allowed to run
+        broken = False
+        i = 0
+        while i < len(queue) and len(running) < workers:
+            index = queue[i]
+            if in_use + costs[index] <= budget or len(running) == 0:
+                del queue[i]
+                if claim is not None and not claim(items[index]):
+                    yield items[index], None, None
+                    continue
+                try:
+                    future = pool.submit(function, items[index])
+                except BrokenProcessPool:
+                    # not started, it goes to the new pool
+                    queue.insert(i, index)
+                    broken = True
+                    break
+                running[future] = index
+                in_use += costs[index]
+            else:
+                i += 1
+
+        if running and not broken:
+            done, not_done = wait(running.keys(), return_when=FIRST_COMPLETED)
+            for future in done:
+                if isinstance(future.exception(), BrokenProcessPool):
+                    broken = True
+                    continue
+                index = running.pop(future)
+                in_use -= costs[index]
+                yield items[index], future.result(), None
+        if broken:
+            # every job that was still running in the pool is lost
+            lost = list(running.values())
+            running = {}
+            in_use = 0
+            pool.restart()
+            for index in lost:
+                yield items[index], None, BrokenProcessPool('the worker process died (out of memory?)')
@@ -0,0 +1,330 @@
+#!/usr/bin/env python3
+
+# Distributed conversion over a shared destination
+# With --shard i/N every node converts the raws whose path hashes to its shard
+# first and then helps with the files of the other shards, starting at the end
+# of their lists. Before a file is converted it is claimed with a lease file in
+# the destination (created with O_EXCL, which also works on NFS). Nodes renew
+# their leases while they work, so a lease that was not renewed for LEASE_TIME
+# seconds belongs to a dead node and is taken over. Finished files keep a done
+# lease with the size, mtime and settings of the source, so other nodes skip
+# them. Every node also writes its progress to the lease folder, the totals of
+# all nodes of the same run are printed from time to time. Nodes that start
+# while others are still working join their run, the last node that leaves
+# ends it. A node counts the files of its own
+# shard as done when they are up to date or converted (by itself or by a
+# helper), conversions for other shards are only counted as help.
+# Lease times are compared with the clock of the file server, not the local one.
+# Rare races (two nodes taking over the same stale lease) can only lead to a
+# file being converted twice, never to a file being left out.
+
+import argparse
+import hashlib
+import json
+import os
+import socket
+import threading
+import time
+
+
+LEASE_DIR = '.raw-to-jpg-leases'
+
+# seconds after which a lease that was not renewed counts as abandoned
+LEASE_TIME = 120
+
+# seconds between the progress lines of all nodes
+PROGRESS_INTERVAL = 30
+
+COUNTERS = ('files', 'up_to_date', 'converted', 'helped', 'failed')
+
+
+# argparse type for i/N
+def parse_shard(spec):
+    try:
+        index, count = (int(part) for part in spec.split('/'))
+    except ValueError:
+        raise argparse.ArgumentTypeError('expected a shard like 0/4')
+    if count < 1 or not 0 <= index < count:
+        raise argparse.ArgumentTypeError('the shard index must be between 0 and N-1')
+    return index, count
+
+
+# name of this node (host and process)
+def node_name():
+    return socket.gethostname() + ':' + str(os.getpid())
+
+
+# unique file name part of this node
+def node_token():
+    return hashlib.sha1(node_name().encode()).hexdigest()[:12]
+
+
+# temporary file next to path that is moved into place when complete
+# the pid alone is not unique on a destination shared by several machines (containers often share pids)
+def temp_path(path):
+    return os.path.join(os.path.dirname(path), '.' + os.path.basename(path) + '.' + node_token() + '.part')
+
+
+# stable over runs, machines and python versions (unlike hash())
+def shard_of(path, count):
+    return int(hashlib.sha1(path.encode()).hexdigest()[:8], 16) % count
+
+
+class Leases:
+    def __init__(self, directory, shard, verbose=True, lease_time=LEASE_TIME):
+        self.directory = os.path.join(directory, LEASE_DIR)
+        os.makedirs(self.directory, exist_ok=True)
+        self.index, self.count = shard
+        self.verbose = verbose
+        self.lease_time = lease_time
+        self.node = node_name()
+        self.token = node_token()
+        self.held = set()
+        # paths that were left to another node that was still converting them
+        self.busy = set()
+        self.counters = dict((name, 0) for name in COUNTERS)
+        self.clock = None
+        self.finished = False
+        self.lock = threading.Lock()
+        # done leases older than this are left over from earlier runs
+        self.started = self.now()
+        self.run = self.join_run()
+        self.write_progress()
+        self.stop = threading.Event()
+        self.thread = threading.Thread(target=self.heartbeat, daemon=True)
+        self.thread.start()
+
+    # every shard keeps its own manifest, sqlite must not be shared over nfs
+    @property
+    def manifest_name(self):
+        return '.raw-to-jpg.' + str(self.index) + '-of-' + str(self.count) + '.sqlite'
+
+    @property
+    def run_path(self):
+        return os.path.join(self.directory, 'run.json')
+
+    @property
+    def progress_path(self):
+        return os.path.join(self.directory, 'progress-' + str(self.index) + '-of-' + str(self.count) + '.json')
+
+    # id of the run of the nodes that are still working, or of a new run
+    # the run file is renewed like a lease while nodes work on it
+    def join_run(self):
+        for attempt in range(50):
+            try:
+                fd = os.open(self.run_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o644)
+            except FileExistsError:
+                entry = self.read(self.run_path)
+                if entry is None:
+                    continue
+                content, mtime = entry
+                if self.now() - mtime < self.lease_time:
+                    if 'run' in content:
+                        return content['run']
+                    # just created by another node, the id is not written yet
+                    time.sleep(0.1)
+                    continue
+                # the nodes of that run died, only one node can move it out of the way
+                stale = self.run_path + '.' + self.token + '.stale'
+                try:
+                    os.rename(self.run_path, stale)
+                except FileNotFoundError:
+                    continue
+                os.remove(stale)
+                continue
+            run = self.token + '-' + str(int(self.started))
+            with os.fdopen(fd, 'w') as f:
+                json.dump({ 'run': run }, f)
+            return run
+        # the run file keeps changing, count on our own
+        return self.token
+
+    def is_own(self, path):
+        return shard_of(path, self.count) == self.index
+
+    def lease_path(self, path):
+        return os.path.join(self.directory, hashlib.sha1(path.encode()).hexdigest() + '.lease')
+
+    # current time of the file server
+    def now(self):
+        with self.lock:
+            if self.clock is None or time.monotonic() - self.clock[1] > self.lease_time / 4:
+                clock_file = os.path.join(self.directory, 'clock-' + self.token)
+                with open(clock_file, 'a'):
+                    pass
+                # without explicit times the server sets its own
+                os.utime(clock_file, None)
+                self.clock = (os.stat(clock_file).st_mtime, time.monotonic())
+            return self.clock[0] + time.monotonic() - self.clock[1]
+
+    # returns (content, mtime) of a lease or None if there is none
+    def read(self, lease):
+        try:
+            with open(lease) as f:
+                mtime = os.fstat(f.fileno()).st_mtime
+                text = f.read()
+        except FileNotFoundError:
+            return None
+        try:
+            return json.loads(text), mtime
+        except ValueError:
+            # just created, the content is not written yet
+            return { 'state': 'working' }, mtime
+
+    # try to get the exclusive right to convert path, returns claimed, done or busy
+    # key describes the source and settings, a done lease with the same key means there is nothing to do
+    # unless force is set and it was written before this node started (--overwrite)
+    def claim(self, path, key, force=False):
+        lease = self.lease_path(path)
+        for attempt in range(3):
+            try:
+                fd = os.open(lease, os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o644)
+            except FileExistsError:
+                entry = self.read(lease)
+                if entry is None:
+                    continue
+                content, mtime = entry
+                if content.get('state') == 'done' and content.get('key') == key and not (force and mtime < self.started):
+                    return 'done'
+                if content.get('state') == 'working' and self.now() - mtime < self.lease_time:
+                    with self.lock:
+                        self.busy.add(path)
+                    return 'busy'
+                # abandoned or outdated, only one node can move it out of the way
+                stale = lease + '.' + self.token + '.stale'
+                try:
+                    os.rename(lease, stale)
+                except FileNotFoundError:
+                    continue
+                os.remove(stale)
+                continue
+            with os.fdopen(fd, 'w') as f:
+                json.dump({ 'state': 'working', 'node': self.node, 'path': path }, f)
+            with self.lock:
+                self.held.add(lease)
+            return 'claimed'
+        with self.lock:
+            self.busy.add(path)
+        return 'busy'
+
+    # mark a claimed file as converted
+    def finish(self, path, key):
+        lease = self.lease_path(path)
+        with self.lock:
+            self.held.discard(lease)
+        entry = self.read(lease)
+        if entry is None or entry[0].get('node') != self.node:
+            # taken over while we were working, the other node will finish it
+            return
+        temp = temp_path(lease)
+        with open(temp, 'w') as f:
+            json.dump({ 'state': 'done', 'node': self.node, 'path': path, 'key': key }, f)
+        os.replace(temp, lease)
+
+    # give up a claimed file (e.g. after an error), another node may try it
+    def release(self, path):
+        lease = self.lease_path(path)
+        with self.lock:
+            self.held.discard(lease)
+        entry = self.read(lease)
+        if entry is not None and entry[0].get('node') == self.node:
+            try:
+                os.remove(lease)
+            except FileNotFoundError:
+                pass
+
+    def add_progress(self, **counts):
+        with self.lock:
+            for name, count in counts.items():
+                self.counters[name] += count
+
+    def write_progress(self):
+        with self.lock:
+            progress = dict(self.counters, node=self.node, shard=self.index, run=self.run, finished=self.finished)
+        temp = temp_path(self.progress_path)
+        with open(temp, 'w') as f:
+            json.dump(progress, f)
+        os.replace(temp, self.progress_path)
+
+    # (progress, mtime) of the shards that reported in this run
+    def read_progress(self):
+        reports = []
+        for index in range(self.count):
+            path = os.path.join(self.directory, 'progress-' + str(index) + '-of-' + str(self.count) + '.json')
+            try:
+                with open(path) as f:
+                    mtime = os.fstat(f.fileno()).st_mtime
+                    progress = json.load(f)
+            except (OSError, ValueError):
+                continue
+            if progress.get('run') == self.run:
+                reports.append((progress, mtime))
+        return reports
+
+    # counters summed over the progress files of all shards of this run, plus the number of shards
+    # that reported and of nodes that are still active
+    def progress(self):
+        totals = dict((name, 0) for name in COUNTERS)
+        reporting = 0
+        active = 0
+        now = self.now()
+        for progress, mtime in self.read_progress():
+            for name in COUNTERS:
+                totals[name] += progress.get(name, 0)
+            reporting += 1
+            if now - mtime < self.lease_time and not progress.get('finished'):
+                active += 1
+        return totals, reporting, active
+
+    def print_progress(self):
+        self.write_progress()
+        totals, reporting, active = self.progress()
+        print('...all shards: ' + str(totals['up_to_date'] + totals['converted']) + ' of ' + str(totals['files']) + ' files done in '
+              + str(reporting) + ' of ' + str(self.count) + ' shards (' + str(totals['converted'] + totals['helped']) + ' converted, '
+              + str(totals['failed']) + ' failed, ' + str(active) + ' active nodes)')
+
+    # renew the held leases and publish the progress
+    def heartbeat(self):
+        last_print = time.monotonic()
+        while not self.stop.wait(self.lease_time / 4):
+            with self.lock:
+                held = list(self.held)
+            for lease in held + [self.run_path]:
+                try:
+                    os.utime(lease, None)
+                except FileNotFoundError:
+                    pass
+            try:
+                self.write_progress()
+                if self.verbose and time.monotonic() - last_print > PROGRESS_INTERVAL:
+                    self.print_progress()
+                    last_print = time.monotonic()
+            except OSError:
+                # the share is gone for a moment, try again next time
+                pass
+
+    def close(self):
+        self.stop.set()
+        self.thread.join()
+        self.finished = True
+        self.write_progress()
+        for lease in list(self.held):
+            try:
+                os.remove(lease)
+            except FileNotFoundError:
+                pass
+        # the last node ends the run, so the next start does not add to its counters
+        now = self.now()
+        others = [progress for progress, mtime in self.read_progress()
+                  if not progress.get('finished') and progress.get('node') != self.node and now - mtime < self.lease_time / 2]
+        entry = self.read(self.run_path)
+        if len(others) == 0 and entry is not None and entry[0].get('run') == self.run:
+            try:
+                os.remove(self.run_path)
+            except FileNotFoundError:
+                pass
+        # the clock file is only used while the node runs
+        try:
+            os.remove(os.path.join(self.directory, 'clock-' + self.token))
+        except FileNotFoundError:
+            pass
@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+
+# Writer for 16 bit rgb tiffs
+# PIL can only write 8 bit rgb images, but libraw can deliver 16 bits per channel.
+# Compressed files use deflate with the horizontal predictor, in strips of a few
+# rows so readers do not have to inflate the whole image at once.
+
+import os
+import struct
+import zlib
+
+
+SHORT = 3
+LONG = 4
+
+COMPRESSION_NONE = 1
+COMPRESSION_DEFLATE = 8
+PREDICTOR_HORIZONTAL = 2
+
+ROWS_PER_STRIP = 16
+
+
+# target is a path or a binary file object
+# compression: none or deflate
+def write_tiff16(target, rgb, compression='none'):
+    height, width = rgb.shape[:2]
+    if compression == 'deflate':
+        # difference to the same channel of the previous pixel (wraps around like the predictor expects)
+        diff = rgb.astype('<u2')
+        diff[:, 1:, :] -= rgb[:, :-1, :].astype('<u2')
+        rows_per_strip = ROWS_PER_STRIP
+        strips = [zlib.compress(diff[row:row + rows_per_strip].tobytes(), 6) for row in range(0, height, rows_per_strip)]
+    elif compression == 'none':
+        rows_per_strip = height
+        strips = [rgb.astype('<u2').tobytes()]
+    else:
+        raise ValueError('unsupported compression ' + str(compression))
+
+    # the bits per sample array does not fit into a tag entry and goes in front of the image data
+    bits_offset = 8
+    data_offset = bits_offset + 6
+    strip_offsets = []
+    offset = data_offset
+    for strip in strips:
+        strip_offsets.append(offset)
+        offset += len(strip)
+    offset += offset % 2
+    # with several strips the offsets and byte counts go behind the data as well
+    offsets_offset = offset
+    counts_offset = offsets_offset + 4 * len(strips)
+    ifd_offset = counts_offset + 4 * len(strips) if len(strips) > 1 else offset
+    entries = [
+        (256, LONG, 1, width),
+        (257, LONG, 1, height),
+        (258, SHORT, 3, bits_offset),
+        (259, SHORT, 1, COMPRESSION_DEFLATE if compression == 'deflate' else COMPRESSION_NONE),
+        (262, SHORT, 1, 2),
+        (273, LONG, len(strips), offsets_offset if len(strips) > 1 else strip_offsets[0]),
+        (277, SHORT, 1, 3),
+        (278, LONG, 1, rows_per_strip),
+        (279, LONG, len(strips), counts_offset if len(strips) > 1 else len(strips[0])),
+        (284, SHORT, 1, 1),
+    ]
+    if compression == 'deflate':
+        entries.append((317, SHORT, 1, PREDICTOR_HORIZONTAL))
+
+    f = open(target, 'wb') if isinstance(target, (str, bytes, os.PathLike)) else target
+    try:
+        f.write(b'II*\0' + struct.pack('<I', ifd_offset))
+        f.write(struct.pack('<3H', 16, 16, 16))
+        for strip in strips:
+            f.write(strip)
+        f.write(b'\0' * (offsets_offset - strip_offsets[-1] - len(strips[-1])))
+        if len(strips) > 1:
+            f.write(struct.pack('<%dI' % len(strips), *strip_offsets))
+            f.write(struct.pack('<%dI' % len(strips), *[len(strip) for strip in strips]))
+        f.write(struct.pack('<H', len(entries)))
+        for tag, typ, count, value in entries:
+            if typ == SHORT and count == 1:
+                f.write(struct.pack('<HHIHH', tag, typ, count, value, 0))
+            else:
+                f.write(struct.pack('<HHII', tag, typ, count, value))
+        f.write(struct.pack('<I', 0))
+    finally:
+        if f is not target:
+            f.close()
@@ -0,0 +1,179 @@
+#!/usr/bin/env python3
+
+# Watch a source tree for new files with inotify (linux only)
+# A file counts as complete once it was closed after writing (or moved into
+# the tree) and its size did not change for the settle time afterwards. Events
+# are read in a background thread, so bursts of files do not fill up the
+# kernel queue while conversions are running. Only folders created while
+# watching are listed, the tree is never rescanned unless the kernel reports
+# lost events.
+
+import ctypes
+import ctypes.util
+import errno
+import os
+import select
+import struct
+import threading
+import time
+
+
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+
+WATCH_MASK = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE | IN_ONLYDIR
+
+# struct inotify_event without the name
+EVENT = struct.Struct('iIII')
+
+READ_SIZE = 64 * 1024
+
+
+def load_libc():
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        libc.inotify_init1
+        return libc
+    except (OSError, AttributeError):
+        return None
+
+
+class Watcher:
+    # in_path: root of the watched tree, paths are reported relative to it (like r2j_scan)
+    # settle: seconds a file must stay unchanged after it was closed
+    def __init__(self, in_path, recursion=True, settle=2.0):
+        self.libc = load_libc()
+        if self.libc is None:
+            raise OSError(errno.ENOSYS, 'watching folders needs inotify (linux only)')
+        self.fd = self.libc.inotify_init1(os.O_CLOEXEC)
+        if self.fd < 0:
+            e = ctypes.get_errno()
+            raise OSError(e, 'inotify: ' + os.strerror(e))
+        self.in_path = in_path
+        self.recursion = recursion
+        self.settle = settle
+        # watch descriptor => folder
+        self.watches = {}
+        # path => (deadline, closed, size)
+        self.pending = {}
+        self.overflow = False
+        self.lock = threading.Lock()
+        self.stop = threading.Event()
+        self.add_tree('/')
+        self.thread = threading.Thread(target=self.read_events, daemon=True)
+        self.thread.start()
+
+    def add_watch(self, folder):
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(self.in_path + folder), WATCH_MASK)
+        if wd < 0:
+            e = ctypes.get_errno()
+            if e in (errno.ENOENT, errno.ENOTDIR):
+                # removed again in the meantime
+                return False
+            raise OSError(e, 'inotify: ' + os.strerror(e), self.in_path + folder)
+        self.watches[wd] = folder
+        return True
+
+    # watch a folder and its subfolders
+    # with announce the files already inside are treated as new (folders created while watching)
+    def add_tree(self, folder, announce=False):
+        if not self.add_watch(folder):
+            return
+        try:
+            with os.scandir(self.in_path + folder) as it:
+                entries = list(it)
+        except OSError:
+            return
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+                if self.recursion:
+                    self.add_tree(folder + entry.name + '/', announce=announce)
+            elif announce and entry.is_file(follow_symlinks=False):
+                self.touch(folder + entry.name, closed=True)
+
+    def touch(self, path, closed):
+        if os.path.basename(path).startswith('.'):
+            # temporary files of copy tools (and our own), the final name is moved into place
+            return
+        try:
+            size = os.stat(self.in_path + path).st_size
+        except OSError:
+            return
+        with self.lock:
+            self.pending[path] = (time.monotonic() + self.settle, closed, size)
+
+    def read_events(self):
+        while not self.stop.is_set():
+            readable, _, _ = select.select([self.fd], [], [], 0.5)
+            if not readable:
+                continue
+            try:
+                data = os.read(self.fd, READ_SIZE)
+            except OSError:
+                return
+            offset = 0
+            while offset < len(data):
+                wd, mask, cookie, length = EVENT.unpack_from(data, offset)
+                name = os.fsdecode(data[offset + EVENT.size:offset + EVENT.size + length].rstrip(b'\0'))
+                offset += EVENT.size + length
+                self.handle(wd, mask, name)
+
+    def handle(self, wd, mask, name):
+        if mask & IN_Q_OVERFLOW:
+            self.overflow = True
+            return
+        if mask & IN_IGNORED:
+            self.watches.pop(wd, None)
+            return
+        folder = self.watches.get(wd)
+        if folder is None:
+            return
+        if mask & IN_ISDIR:
+            if mask & (IN_CREATE | IN_MOVED_TO) and self.recursion:
+                self.add_tree(folder + name + '/', announce=True)
+        elif mask & (IN_CLOSE_WRITE | IN_MOVED_TO):
+            self.touch(folder + name, closed=True)
+        elif mask & IN_MODIFY:
+            self.touch(folder + name, closed=False)
+
+    # paths of the files that are completely written, each one is only returned once
+    def ready(self):
+        now = time.monotonic()
+        paths = []
+        with self.lock:
+            for path, (deadline, closed, size) in list(self.pending.items()):
+                if not closed or deadline > now:
+                    continue
+                try:
+                    current = os.stat(self.in_path + path).st_size
+                except OSError:
+                    # deleted before it settled
+                    del self.pending[path]
+                    continue
+                if current != size:
+                    self.pending[path] = (now + self.settle, closed, current)
+                    continue
+                del self.pending[path]
+                paths.append(path)
+        return sorted(paths)
+
+    # paths of the files that are still being written
+    def unsettled(self):
+        with self.lock:
+            return list(self.pending)
+
+    # whether events were lost since the last call, the tree has to be scanned then
+    def overflowed(self):
+        overflow, self.overflow = self.overflow, False
+        return overflow
+
+    def close(self):
+        self.stop.set()
+        self.thread.join()
+        os.close(self.fd)
@@ -1,40 +1,142 @@
 #!/usr/bin/env python3
 
 import argparse
-import numpy
+import contextlib
+import functools
+import io
 import os
 import platform
-import rawpy
-#import rawpy.enhance --- Only import is needed to avoid unnecessary dependencies
-import shutil
 import sys
-from PIL import Image
+import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
-
-import r2j_linuxgui as linuxgui
+# numpy, rawpy, PIL and gtk are imported where they are needed,
+# so archive mode and --help start fast and work without them
+
+import r2j_archive
+import r2j_converter
+import r2j_dedupe
+import r2j_encoders
+import r2j_exif
+import r2j_manifest
+import r2j_pipeline
+import r2j_progress
+import r2j_renditions
+import r2j_report
+import r2j_scan
+import r2j_scheduler
+import r2j_shard
 
 # This list/tuple may contain any raw file ending supported by libraw
 # Unfortunately I was not able to find a list with all supported types
 # Feel free to add some, open an issue or open a PR
-RAW_FILE_ENDINGS = ( '.CR2', '.cr2', '.nef', '.NEF' )
+# Endings are matched case-insensitively, so keep them lower case
+RAW_FILE_ENDINGS = ( '.cr2', '.cr3', '.nef', '.nrw', '.arw', '.dng', '.orf', '.raf', '.rw2', '.pef', '.srw' )
+
+def is_raw_file(path):
+    return path.lower().endswith(RAW_FILE_ENDINGS)
+
+
+# number of files buffered between two pipeline stages
+# every slot holds either a raw file or a decoded image, so keep it small
+PIPELINE_QUEUE_SIZE = 2
 
+# in watch mode files are converted once they did not change for WATCH_SETTLE_TIME seconds after writing,
+# new files are collected every WATCH_INTERVAL seconds
+WATCH_SETTLE_TIME = 2
+WATCH_INTERVAL = 0.5
+
+# failed conversions as (in_path, out_path, path, message)
 errors = []
 
+# run report (see r2j_report), only set with --report
+report = None
 
-# converter function which iterates through list of files
-def convert_raw_to_jpg(in_path, out_path, path, verbose=True, overwrite=False, auto_wb=False, enhance=False, tiff=False):
-    # file vars
-    file_name = os.path.basename(in_path + path)
-    file_without_ext = os.path.splitext(file_name)[0]
+# leases on the shared destination (see r2j_shard), only set with --shard
+leases = None
+
+# fingerprints of the sources (see r2j_dedupe), only set with --dedupe
+fingerprints = None
+
+# machine readable progress (see r2j_progress), only set with --progress
+progress = None
+
+
+# renditions of a job, by default a single full size jpg or tiff
+def job_renditions(kwargs):
+    return kwargs.get('renditions') or [r2j_renditions.default_rendition(kwargs.get('tiff', False))]
+
+
+# location of a converted image and whether it can be skipped
+# every rendition gets its own directory tree below the destination
+# the file name comes from in_path + path, in single file mode path is empty
+def output_location(in_path, out_path, path, rendition):
+    name, fmt, size = rendition
+    file_without_ext = os.path.splitext(os.path.basename(in_path + path))[0]
+    # the same way for the destination itself (no name) and named subfolders, also for single files
+    parent = os.path.join(out_path, name, path[:path.rfind('/') + 1].lstrip('/'))
+    return parent, parent + file_without_ext + r2j_renditions.FORMATS[fmt]
+
+
+def output_exists(in_path, out_path, path, rendition):
+    parent, image_location = output_location(in_path, out_path, path, rendition)
+    file_without_ext = os.path.splitext(os.path.basename(in_path + path))[0]
+    return os.path.exists(image_location) or (rendition[1] == 'jpg' and os.path.exists(parent + file_without_ext + '.JPG'))
+
+
+# read the whole raw file into memory
+def read_raw(in_path, path, record=None):
+    with r2j_report.stage(record, 'read'):
+        with open(in_path + path, 'rb') as f:
+            data = f.read()
+    if record is not None:
+        record['bytes_read'] = len(data)
+    return data
+
+
+# encode and write all renditions of an image, keeping the timestamp of the raw file
+# the image is either an rgb array or an already encoded jpeg (embedded preview)
+# files are written to a temporary file first, so an interrupted run never leaves a truncated image behind
+def save_renditions(image, in_path, out_path, path, renditions, encoder=None, record=None):
     file_timestamp = os.path.getmtime(in_path + path)
-    parent = out_path + path[:path.rfind('/') + 1]
-    if tiff:
-        jpg_image_location = parent + file_without_ext + '.tiff'
-    else:
-        jpg_image_location = parent + file_without_ext + '.jpg'
+    rendered_images = r2j_renditions.render(image, renditions)
+    while True:
+        # resampling (and converting arrays to PIL images) happens inside the generator
+        with r2j_report.stage(record, 'resample'):
+            entry = next(rendered_images, None)
+        if entry is None:
+            break
+        rendition, rendered = entry
+        parent, image_location = output_location(in_path, out_path, path, rendition)
+        # create directory if not existent
+        if not os.path.isdir(parent):
+            os.makedirs(parent, exist_ok=True)
+        temp_location = r2j_shard.temp_path(image_location)
+        try:
+            # encoding includes writing the temporary file
+            with r2j_report.stage(record, 'encode'):
+                with open(temp_location, 'wb') as f:
+                    r2j_encoders.encode_image(rendered, rendition[1], f, settings=encoder)
+            with r2j_report.stage(record, 'finalize'):
+                if record is not None:
+                    record['bytes_written'] += os.path.getsize(temp_location)
+                # update JPG file timestamp to match RAW
+                os.utime(temp_location, (file_timestamp, file_timestamp))
+                os.replace(temp_location, image_location)
+        except BaseException:
+            if os.path.exists(temp_location):
+                os.remove(temp_location)
+            raise
 
+
+# converter function which iterates through list of files
+# pass a record (see r2j_report) to measure the stages
+def convert_raw_to_jpg(in_path, out_path, path, verbose=True, overwrite=False, auto_wb=False, enhance=False, tiff=False, preview=False, half_size=False, renditions=None, encoder=None, record=None):
+    renditions = job_renditions(dict(tiff=tiff, renditions=renditions))
     # omit files that already exist in the destination
-    if (os.path.exists(jpg_image_location) or os.path.exists(parent + file_without_ext + '.JPG')) and not overwrite:
+    if not overwrite:
+        renditions = [rendition for rendition in renditions if not output_exists(in_path, out_path, path, rendition)]
+    if len(renditions) == 0:
         if verbose:
             print('...' + path + '\t\t => ignored (file exists)')
         return
@@ -42,30 +144,12 @@ def convert_raw_to_jpg(in_path, out_path, path, verbose=True, overwrite=False, a
     if verbose:
         print('...' + path + '\t\t => converting RAW-file')
 
-    # read raw file
-    raw = rawpy.imread(in_path + path)
-    # enhance
-    if enhance:
-        if type(enhance) == bool:
-            bad_pixels = rawpy.enhance.find_bad_pixels([in_path + path])
-            rawpy.enhance.repair_bad_pixels(raw, bad_pixels)
-        else:
-            bad_pixels = rawpy.enhance.find_bad_pixels(enhance)
-            rawpy.enhance.repair_bad_pixels(raw, bad_pixels)
-    # post processing (with white balance of camera)
-    if auto_wb:
-        rgb = raw.postprocess(use_auto_wb=True)
-    else:
-        rgb = raw.postprocess(use_camera_wb=True)
-    # create directory if not existent
-    if not os.path.isdir(parent):
-        os.makedirs(parent)
-    # save image array
-    Image.fromarray(rgb).save(jpg_image_location, quality=90, optimize=True)
-    # update JPG file timestamp to match RAW
-    os.utime(jpg_image_location, (file_timestamp, file_timestamp))
-
-    raw.close()
+    if record is not None:
+        record['camera'] = r2j_exif.read_camera_tags(in_path + path)['model']
+        record['bytes_read'] = os.path.getsize(in_path + path)
+    image = r2j_converter.decode_raw(in_path + path, in_path, path, auto_wb=auto_wb, enhance=enhance, preview=preview, half_size=half_size,
+                                     output_bps=16 if r2j_renditions.needs_16_bit(renditions) else 8, record=record)
+    save_renditions(image, in_path, out_path, path, renditions, encoder=encoder, record=record)
 
 def copy_other(in_path, out_path, path, verbose=True, overwrite=False, ):
     if os.path.exists(out_path + path) and not overwrite:
@@ -80,84 +164,589 @@ def copy_other(in_path, out_path, path, verbose=True, overwrite=False, ):
     if not os.path.isdir(parent):
         os.makedirs(parent)
 
-    shutil.copy2(os.path.abspath(in_path + path), os.path.abspath(out_path + path))
+    record = r2j_report.new_record(path, kind='copy') if report is not None else None
+    with r2j_report.stage(record, 'copy'):
+        # to a temporary name first, so an interrupted copy never looks complete
+        r2j_archive.copy_file(os.path.abspath(in_path + path), os.path.abspath(out_path + path))
+    if record is not None:
+        record['bytes_read'] = record['bytes_written'] = os.path.getsize(out_path + path)
+        report.add(record)
+
+
+# worker function for the process pool
+# output is captured so the parent can print it in submission order
+def convert_job(job, measure=False):
+    in_path, out_path, path, kwargs = job
+    output = io.StringIO()
+    error = None
+    record = r2j_report.new_record(path) if measure else None
+    with contextlib.redirect_stdout(output):
+        try:
+            convert_raw_to_jpg(in_path, out_path, path, record=record, **kwargs)
+        except Exception as e:
+            error = str(e)
+    return output.getvalue(), error, record
+
+
+def record_error(job, error, verbose=True):
+    in_path, out_path, path, kwargs = job
+    errors.append((in_path, out_path, path, error))
+    if verbose:
+        print('...' + path + '\t\t => failed (' + error + ')')
+
+
+# pipeline stages for serial conversion
+# reading, decoding and encoding overlap, so neither the disk nor the cpu sit idle
+# the record of the file (or None) travels along with the data
+def pipeline_read(job, value):
+    in_path, out_path, path, kwargs = job
+    record = None
+    if report is not None:
+        record = r2j_report.new_record(path)
+        record['camera'] = r2j_exif.read_camera_tags(in_path + path)['model']
+    return read_raw(in_path, path, record=record), record
+
+
+def pipeline_decode(job, value):
+    in_path, out_path, path, kwargs = job
+    data, record = value
+    image = r2j_converter.decode_raw(data, in_path, path, auto_wb=kwargs.get('auto_wb', False), enhance=kwargs.get('enhance', False),
+                                     preview=kwargs.get('preview', False), half_size=kwargs.get('half_size', False),
+                                     output_bps=16 if r2j_renditions.needs_16_bit(job_renditions(kwargs)) else 8, record=record)
+    return image, record
+
+
+def pipeline_save(job, value):
+    in_path, out_path, path, kwargs = job
+    image, record = value
+    save_renditions(image, in_path, out_path, path, job_renditions(kwargs), encoder=kwargs.get('encoder'), record=record)
+    return record or True
+
+
+# settings that change the converted image and therefore invalidate manifest entries
+def conversion_settings(kwargs, rendition):
+    enhance = kwargs.get('enhance', False)
+    settings = dict(auto_wb=kwargs.get('auto_wb', False), tiff=kwargs.get('tiff', False),
+                    enhance=enhance if type(enhance) == bool else 'group',
+                    preview=kwargs.get('preview', False), half_size=kwargs.get('half_size', False))
+    if kwargs.get('renditions'):
+        settings.update(format=rendition[1], size=rendition[2])
+    # only non default encoder settings, so manifests of earlier versions stay valid
+    encoder = kwargs.get('encoder')
+    if encoder:
+        encoder = r2j_encoders.format_settings(encoder, rendition[1])
+        if encoder != r2j_encoders.format_settings(r2j_encoders.PRESETS['default'], rendition[1]):
+            settings.update(encoder=encoder)
+    return settings
+
+
+# manifest key of a rendition, the default rendition is keyed by the source path alone
+def manifest_key(in_path, path, rendition):
+    source = path if path else os.path.basename(in_path)
+    if rendition[0]:
+        return rendition[0] + '/' + source.lstrip('/')
+    return source
+
+
+# whether the output of a rendition is up to date (ignoring --force)
+def rendition_current(job, stat, rendition, manifest=None):
+    in_path, out_path, path, kwargs = job
+    source = manifest_key(in_path, path, rendition)
+    if manifest is not None and source in manifest:
+        settings = r2j_manifest.settings_fingerprint(conversion_settings(kwargs, rendition))
+        return manifest.is_current(source, stat.st_size, stat.st_mtime_ns, settings)
+    # files converted without a manifest (or by an older version)
+    return output_exists(in_path, out_path, path, rendition)
+
+
+# decide which jobs and renditions have to be converted
+# returns the pending jobs (forced to overwrite, the decision is made here) and their manifest keys
+def select_pending(conversion_jobs, manifest=None, verbose=True):
+    pending = []
+    for job in conversion_jobs:
+        in_path, out_path, path, kwargs = job
+        try:
+            stat = os.stat(in_path + path)
+        except OSError as e:
+            record_error(job, str(e), verbose=verbose)
+            continue
+        renditions = []
+        keys = []
+        for rendition in job_renditions(kwargs):
+            source = manifest_key(in_path, path, rendition)
+            settings = r2j_manifest.settings_fingerprint(conversion_settings(kwargs, rendition))
+            if kwargs.get('overwrite', False) or not rendition_current(job, stat, rendition, manifest=manifest):
+                renditions.append(rendition)
+                keys.append((source, stat.st_size, stat.st_mtime_ns, settings, output_location(in_path, out_path, path, rendition)[1]))
+        if len(renditions) > 0:
+            pending.append(((in_path, out_path, path, dict(kwargs, overwrite=True, renditions=renditions)), keys))
+        elif kwargs.get('verbose', True):
+            print('...' + path + '\t\t => ignored (file exists)')
+    return pending
 
 
-def process_folder(in_path, out_path, path, recursion=False, verbose=True, overwrite=False, smart_mode=False, auto_wb=False, enhance=False, tiff=False):
-    if not str.endswith(path, '/') or path == '':
-        path += '/'
-    if verbose:
-        print('...' + path + '\t\t => browsing folder')
-    for sub_name in os.listdir(in_path + path):
-        sub_path = path + sub_name
-        if os.path.isdir(in_path + sub_path) and recursion:
-            process_folder(in_path, out_path, sub_path, recursion=recursion, verbose=verbose, overwrite=overwrite,
-                           smart_mode=smart_mode, auto_wb=auto_wb, enhance=enhance)
-        elif sub_path.endswith(RAW_FILE_ENDINGS):
-            convert_raw_to_jpg(in_path, out_path, sub_path, verbose=verbose, overwrite=overwrite, auto_wb=auto_wb, enhance=enhance, tiff=tiff)
-        elif smart_mode and os.path.isfile(in_path + sub_path):
-            copy_other(in_path, out_path, sub_path, verbose=verbose, overwrite=overwrite)
-
-
-def process_folder_ge(in_path, out_path, path, recursion=False, verbose=True, overwrite=False, smart_mode=False, auto_wb=False, tiff=False):
-    if not str.endswith(path, '/') or path == '':
-        path += '/'
-    if verbose:
-        print('...' + path + '\t\t => browsing folder')
-    raw_files = []
-    bad_pixel_paths = []
-    for sub_name in os.listdir(in_path + path):
-        sub_path = path + sub_name
-        if os.path.isdir(in_path + sub_path) and recursion:
-            process_folder(in_path, out_path, sub_path, recursion=recursion, verbose=verbose, overwrite=overwrite,
-                           smart_mode=smart_mode, auto_wb=auto_wb, enhance=enhance)
-        elif sub_path.endswith(RAW_FILE_ENDINGS):
-            bad_pixel_paths.append(in_path + sub_path)
-            raw_files.append((in_path, out_path, sub_path))
-        elif smart_mode and os.path.isfile(in_path + sub_path):
-            copy_other(in_path, out_path, sub_path, verbose=verbose, overwrite=overwrite)
-
-    # convert raws all at once
-    for raw_file in raw_files:
-        convert_raw_to_jpg(raw_file[0], raw_file[1], raw_file[2], verbose=verbose, overwrite=overwrite, auto_wb=auto_wb, enhance=bad_pixel_paths, tiff=tiff)
-
-def copy_raw_folder(in_path, out_path, path, verbose=True, overwrite=False, move=False):
-    if not str.endswith(path, '/') or path == '':
-        path += '/'
-    if verbose:
-        print('...' + path + '\t\t => browsing folder')
-    for sub_name in os.listdir(in_path + path):
-        sub_path = path + sub_name
-        if os.path.isdir(in_path + sub_path):
-            copy_raw_folder(in_path, out_path, sub_path, verbose=verbose, overwrite=overwrite, move=move)
-        elif sub_path.endswith(RAW_FILE_ENDINGS):
+def finish_job(job, keys, manifest=None):
+    if manifest is not None:
+        for key in keys:
+            manifest.record(*key)
+    if leases is not None:
+        leases.finish(job[2], lease_key(keys))
+        if leases.is_own(job[2]):
+            leases.add_progress(converted=1)
+        else:
+            leases.add_progress(helped=1)
+    if progress is not None:
+        progress.file_done(job[2])
+
+
+def fail_job(job, error, verbose=True):
+    record_error(job, error, verbose=verbose)
+    if leases is not None:
+        leases.release(job[2])
+        leases.add_progress(failed=1)
+    if progress is not None:
+        progress.file_done(job[2], 'failed')
+
+
+# source and settings of a job as stored in done leases
+# the output location is left out, the share may be mounted elsewhere on other nodes
+def lease_key(keys):
+    return [[source, size, mtime, settings] for source, size, mtime, settings, output in keys]
+
+
+# duplicates among the pending jobs as path => path of the source with the same content (see r2j_dedupe)
+# earlier sources only count if all of their renditions are up to date
+def find_duplicates(conversion_jobs, pending_jobs, manifest=None):
+    in_path, out_path, path, options = conversion_jobs[0]
+
+    def done(path):
+        try:
+            stat = os.stat(in_path + path)
+        except OSError:
+            return False
+        return all(rendition_current((in_path, out_path, path, options), stat, rendition, manifest=manifest)
+                   for rendition in job_renditions(options))
+
+    pending_paths = set(job[2] for job in pending_jobs)
+    return fingerprints.find_duplicates([job[2] for job in pending_jobs], lambda path: in_path + path, done=done,
+                                        known=[job[2] for job in conversion_jobs if job[2] not in pending_paths])
+
+
+# fill in the renditions of duplicates with links to the images of their originals
+def link_duplicates(duplicate_jobs, duplicates, keys, manifest=None, verbose=True):
+    failed = set(e[2] for e in errors)
+    for job in duplicate_jobs:
+        in_path, out_path, path, kwargs = job
+        original = duplicates[path]
+        if original in failed:
+            fail_job(job, 'duplicate of ' + original + ', which failed', verbose=verbose)
+            continue
+        record = r2j_report.new_record(path, kind='link') if report is not None else None
+        try:
+            with r2j_report.stage(record, 'link'):
+                for rendition in job_renditions(kwargs):
+                    parent, image_location = output_location(in_path, out_path, path, rendition)
+                    if not os.path.isdir(parent):
+                        os.makedirs(parent, exist_ok=True)
+                    method = r2j_dedupe.link_file(output_location(in_path, out_path, original, rendition)[1], image_location)
+        except OSError as e:
+            fail_job(job, str(e), verbose=verbose)
+            continue
+        if verbose:
+            print('...' + path + '\t\t => ' + method + ' (duplicate of ' + original + ')')
+        if record is not None:
+            report.add(record)
+        finish_job(job, keys[id(job)], manifest=manifest)
+
+
+def open_manifest(out_path):
+    if leases is not None:
+        return r2j_manifest.Manifest(out_path, name=leases.manifest_name)
+    return r2j_manifest.Manifest(out_path)
+
+
+# peak memory of a job for the scheduler
+def job_memory(job):
+    in_path, out_path, path, kwargs = job
+    try:
+        return r2j_scheduler.estimate_memory(in_path + path, half_size=kwargs.get('half_size', False) or kwargs.get('preview', False),
+                                             output_bps=16 if r2j_renditions.needs_16_bit(job_renditions(kwargs)) else 8)
+    except OSError:
+        # the conversion itself will report the problem
+        return 0
+
+
+# gives the pending jobs of group enhance the bad pixel maps of their camera (see r2j_badpixels)
+# the maps are made from all raws in the folders of the pending jobs, so converted folders are
+# not searched again and a few new files get the map of their whole folder
+# unsettled are source files that are still being written (--watch), they are left out
+def add_bad_pixel_maps(pending, bad_pixel_cache, verbose=True, unsettled=()):
+    folders = {}
+    for (in_path, out_path, path, kwargs), key in pending:
+        folders.setdefault(in_path + path[:path.rfind('/') + 1], set()).add(in_path + path)
+    maps = {}
+    for folder, sources in sorted(folders.items()):
+        for name in os.listdir(folder):
+            if is_raw_file(name) and folder + name not in unsettled and os.path.isfile(folder + name):
+                sources.add(folder + name)
+        maps.update(bad_pixel_cache.bad_pixel_maps(sorted(sources), verbose=verbose))
+    bad_pixel_cache.save()
+    return [((in_path, out_path, path, dict(kwargs, enhance=maps[in_path + path])), key)
+            for (in_path, out_path, path, kwargs), key in pending]
+
+
+# converts a list of (in_path, out_path, path, kwargs) jobs either in a streaming pipeline or in a process pool
+# an open manifest can be passed in by the caller, otherwise one is opened in the destination
+# in the process pool no more jobs run at once than fit into max_memory (see r2j_scheduler)
+# with --shard every job is claimed right before it starts, own_shard counts the jobs in the progress of this shard
+# with --dedupe duplicates are not converted but linked to the images of their originals
+# a pool (see r2j_scheduler) can be passed in to keep the worker processes between calls
+# with a bad pixel cache (group enhance) the pending jobs get the bad pixel maps of their camera
+def run_conversions(conversion_jobs, jobs=1, verbose=True, use_manifest=True, manifest=None, max_memory=None, own_shard=False, pool=None,
+                    bad_pixel_cache=None, unsettled=()):
+    if jobs == 0:
+        jobs = os.cpu_count() or 1
+    if len(conversion_jobs) == 0:
+        return
+    own_manifest = manifest is None and use_manifest
+    if own_manifest:
+        manifest = open_manifest(conversion_jobs[0][1])
+    try:
+        pending = select_pending(conversion_jobs, manifest=manifest, verbose=verbose)
+        if bad_pixel_cache is not None and len(pending) > 0:
+            pending = add_bad_pixel_maps(pending, bad_pixel_cache, verbose=verbose, unsettled=unsettled)
+        keys = dict((id(job), key) for job, key in pending)
+        pending_jobs = [job for job, key in pending]
+        if leases is not None and own_shard:
+            leases.add_progress(files=len(conversion_jobs), up_to_date=len(conversion_jobs) - len(pending_jobs))
+        if progress is not None:
+            progress.queued(len(conversion_jobs), skipped=len(conversion_jobs) - len(pending_jobs))
+        duplicates = {}
+        if fingerprints is not None and len(pending_jobs) > 0:
+            duplicates = find_duplicates(conversion_jobs, pending_jobs, manifest=manifest)
+        duplicate_jobs = [job for job in pending_jobs if job[2] in duplicates]
+        pending_jobs = [job for job in pending_jobs if job[2] not in duplicates]
+
+        overwrite = conversion_jobs[0][3].get('overwrite', False)
+
+        def claim(job):
+            if leases is None:
+                return True
+            state = leases.claim(job[2], lease_key(keys[id(job)]), force=overwrite)
+            if state == 'claimed':
+                return True
+            if state == 'done' and own_shard:
+                # converted by a helper
+                leases.add_progress(up_to_date=1)
+            if verbose:
+                print('...' + job[2] + '\t\t => ignored (' + ('converted' if state == 'done' else 'claimed') + ' by another node)')
+            if progress is not None:
+                progress.file_done(job[2], 'skipped')
+            return False
+
+        if jobs == 1 or len(pending_jobs) <= 1:
+            stages = [pipeline_read, pipeline_decode, pipeline_save]
+            # the pipeline takes the jobs one by one, so they are only claimed shortly before they are read
+            claimed_jobs = (job for job in pending_jobs if claim(job))
+            for job, result, error in r2j_pipeline.run_pipeline(claimed_jobs, stages, queue_size=PIPELINE_QUEUE_SIZE):
+                if error is not None:
+                    fail_job(job, str(error), verbose=verbose)
+                    continue
+                if verbose:
+                    print('...' + job[2] + '\t\t => converting RAW-file')
+                if report is not None:
+                    report.add(result)
+                finish_job(job, keys[id(job)], manifest=manifest)
+        else:
+            own_pool = pool is None
+            if own_pool:
+                pool = r2j_scheduler.Pool(jobs)
+            try:
+                costs = [job_memory(job) for job in pending_jobs]
+                budget = max_memory or r2j_scheduler.default_budget()
+                worker = functools.partial(convert_job, measure=report is not None)
+                # results are recorded as soon as they come in, but the captured output
+                # is printed in the order of the jobs, which keeps it deterministic
+                position = dict((id(job), i) for i, job in enumerate(pending_jobs))
+                outputs = {}
+                next_output = 0
+                for job, result, error in r2j_scheduler.run_scheduled(pool, worker, pending_jobs, costs, budget, jobs, claim=claim):
+                    output = ''
+                    if error is not None:
+                        # the worker died, e.g. killed by the oom killer
+                        error = str(error)
+                    elif result is not None:
+                        output, error, record = result
+                    if error is not None:
+                        fail_job(job, error, verbose=False)
+                        output += '...' + job[2] + '\t\t => failed (' + error + ')\n'
+                    elif result is not None:
+                        if report is not None:
+                            report.add(record)
+                        finish_job(job, keys[id(job)], manifest=manifest)
+                    # without result and error the job was claimed by another node
+                    if verbose:
+                        outputs[position[id(job)]] = output
+                        while next_output in outputs:
+                            print(outputs.pop(next_output), end='')
+                            next_output += 1
+            finally:
+                if own_pool:
+                    pool.shutdown()
+        link_duplicates(duplicate_jobs, duplicates, keys, manifest=manifest, verbose=verbose)
+    finally:
+        if own_manifest:
+            manifest.close()
+
+
+# fingerprint of everything that decides what happens to the files of a folder
+def folder_settings(options, smart_mode=False):
+    return r2j_manifest.settings_fingerprint(dict(smart_mode=smart_mode, renditions=job_renditions(options),
+                                                  settings=[conversion_settings(options, rendition) for rendition in job_renditions(options)]))
+
+
+# conversion jobs for files of a single folder, other files are copied along in smart mode
+def folder_jobs(in_path, out_path, paths, options, smart_mode=False):
+    raw_paths = []
+    for sub_path in paths:
+        name = os.path.basename(sub_path)
+        if is_raw_file(name):
+            raw_paths.append(sub_path)
+        elif smart_mode and name not in (r2j_manifest.MANIFEST_NAME, r2j_dedupe.INDEX_NAME) and (leases is None or leases.is_own(sub_path)):
+            copy_other(in_path, out_path, sub_path, verbose=options['verbose'], overwrite=options['overwrite'])
+
+    return [(in_path, out_path, raw_path, options) for raw_path in raw_paths]
+
+
+# the raws of the whole tree are collected first and converted at the end
+# with group_enhance bad pixel maps are computed once per camera and folder (see r2j_badpixels)
+def process_folder(in_path, out_path, path, recursion=False, verbose=True, overwrite=False, smart_mode=False, auto_wb=False, enhance=False, tiff=False, preview=False, half_size=False, renditions=None, encoder=None, jobs=1, use_manifest=True, skip_unchanged=False, group_enhance=False, max_memory=None, pool=None):
+    options = dict(verbose=verbose, overwrite=overwrite, auto_wb=auto_wb, enhance='group' if group_enhance else enhance, tiff=tiff,
+                   preview=preview, half_size=half_size, renditions=renditions, encoder=encoder)
+    manifest = open_manifest(out_path) if use_manifest else None
+    try:
+        settings = folder_settings(options, smart_mode=smart_mode)
+        folders = manifest.folders if manifest is not None and skip_unchanged and not overwrite else None
+        scanner = r2j_scan.Scanner(in_path, recursion=recursion, folders=folders, settings=settings)
+        bad_pixel_cache = None
+        if group_enhance:
+            import r2j_badpixels
+            bad_pixel_cache = r2j_badpixels.BadPixelCache()
+        conversion_jobs = []
+        for folder, files in scanner.walk(path):
+            if files is None:
+                if verbose:
+                    print('...' + folder + '\t\t => ignored (folder unchanged)')
+                continue
+            if verbose:
+                print('...' + folder + '\t\t => browsing folder')
+            conversion_jobs += folder_jobs(in_path, out_path, [sub_path for sub_path, entry in files], options, smart_mode=smart_mode)
+
+        if leases is None:
+            run_conversions(conversion_jobs, jobs=jobs, verbose=verbose, use_manifest=use_manifest, manifest=manifest,
+                            max_memory=max_memory, pool=pool, bad_pixel_cache=bad_pixel_cache)
+        else:
+            # the own shard first, then help with the others from the end of their lists,
+            # so files of nodes that died are taken over and live nodes are rarely met
+            run_conversions([job for job in conversion_jobs if leases.is_own(job[2])], jobs=jobs, verbose=verbose,
+                            use_manifest=use_manifest, manifest=manifest, max_memory=max_memory, own_shard=True, pool=pool,
+                            bad_pixel_cache=bad_pixel_cache)
+            if verbose:
+                print('...helping with the files of the other shards')
+            run_conversions([job for job in reversed(conversion_jobs) if not leases.is_own(job[2])], jobs=jobs, verbose=verbose,
+                            use_manifest=use_manifest, manifest=manifest, max_memory=max_memory, pool=pool,
+                            bad_pixel_cache=bad_pixel_cache)
+            if verbose:
+                leases.print_progress()
+
+        # remember the folders that were converted without errors, so --skip-unchanged can skip them next time
+        # folders with files another node was still converting are not complete either, it may fail
+        if manifest is not None:
+            failed = set(e[2][:e[2].rfind('/') + 1] for e in errors)
+            if leases is not None:
+                failed |= set(busy[:busy.rfind('/') + 1] for busy in leases.busy)
+            for folder, (mtime, subfolders) in scanner.scanned.items():
+                if folder not in failed:
+                    manifest.record_folder(folder, mtime, settings, subfolders)
+    finally:
+        if manifest is not None:
+            manifest.close()
+
+
+def process_folder_ge(in_path, out_path, path, recursion=False, verbose=True, overwrite=False, smart_mode=False, auto_wb=False, tiff=False, preview=False, half_size=False, renditions=None, encoder=None, jobs=1, use_manifest=True, skip_unchanged=False, max_memory=None):
+    process_folder(in_path, out_path, path, recursion=recursion, verbose=verbose, overwrite=overwrite, smart_mode=smart_mode,
+                   auto_wb=auto_wb, tiff=tiff, preview=preview, half_size=half_size, renditions=renditions, encoder=encoder, jobs=jobs,
+                   use_manifest=use_manifest, skip_unchanged=skip_unchanged, group_enhance=True, max_memory=max_memory)
+
+
+# keep converting new files as they arrive in the source tree (see r2j_watch)
+# files that are already there are converted first, like process_folder would
+def watch_folder(in_path, out_path, recursion=False, verbose=True, overwrite=False, smart_mode=False, auto_wb=False, enhance=False, tiff=False, preview=False, half_size=False, renditions=None, encoder=None, jobs=1, use_manifest=True, skip_unchanged=False, group_enhance=False, max_memory=None):
+    import r2j_watch
+    folder_options = dict(recursion=recursion, verbose=verbose, overwrite=overwrite, smart_mode=smart_mode, auto_wb=auto_wb,
+                          enhance=enhance, tiff=tiff, preview=preview, half_size=half_size, renditions=renditions, encoder=encoder, jobs=jobs,
+                          use_manifest=use_manifest, skip_unchanged=skip_unchanged, group_enhance=group_enhance, max_memory=max_memory)
+    options = dict(verbose=verbose, overwrite=overwrite, auto_wb=auto_wb, enhance='group' if group_enhance else enhance, tiff=tiff,
+                   preview=preview, half_size=half_size, renditions=renditions, encoder=encoder)
+    # watch first, so files arriving during the first run are not missed
+    watcher = r2j_watch.Watcher(in_path, recursion=recursion, settle=WATCH_SETTLE_TIME)
+    manifest = None
+    # the worker processes are kept for the whole session instead of being spawned for every batch
+    pool = r2j_scheduler.Pool(jobs or os.cpu_count() or 1) if jobs != 1 else None
+    folder_options['pool'] = pool
+    try:
+        process_folder(in_path, out_path, '', **folder_options)
+        manifest = open_manifest(out_path) if use_manifest else None
+        bad_pixel_cache = None
+        if group_enhance:
+            import r2j_badpixels
+            bad_pixel_cache = r2j_badpixels.BadPixelCache()
+        if verbose:
+            print('\nWatching ' + in_path + ' for new files...')
+        while True:
+            time.sleep(WATCH_INTERVAL)
+            if watcher.overflowed():
+                if verbose:
+                    print('...too many events, scanning the whole tree')
+                # process_folder uses its own connection to the manifest
+                if manifest is not None:
+                    manifest.close()
+                process_folder(in_path, out_path, '', **folder_options)
+                manifest = open_manifest(out_path) if use_manifest else None
+            paths = watcher.ready()
+            if len(paths) == 0:
+                continue
+            folders = {}
+            for sub_path in paths:
+                folders.setdefault(sub_path[:sub_path.rfind('/') + 1], []).append(sub_path)
+            conversion_jobs = []
+            for folder, folder_paths in sorted(folders.items()):
+                conversion_jobs += folder_jobs(in_path, out_path, folder_paths, options, smart_mode=smart_mode)
+            # the maps come from all settled raws of the folder (or the cache), not only from the new files
+            run_conversions(conversion_jobs, jobs=jobs, verbose=verbose, use_manifest=use_manifest, manifest=manifest,
+                            max_memory=max_memory, pool=pool, bad_pixel_cache=bad_pixel_cache,
+                            unsettled=set(in_path + sub_path for sub_path in watcher.unsettled()))
+            if manifest is not None:
+                manifest.commit()
+    finally:
+        watcher.close()
+        if pool is not None:
+            pool.shutdown()
+        if manifest is not None:
+            manifest.close()
+
+
+def archive_file(in_path, out_path, path, move=False, verify=False):
+    parent = out_path + path[:path.rfind('/') + 1]
+    if not os.path.isdir(parent):
+        os.makedirs(parent, exist_ok=True)
+    if move:
+        return r2j_archive.move_file(os.path.abspath(in_path + path), os.path.abspath(out_path + path), verify=verify)
+    else:
+        return r2j_archive.copy_file(os.path.abspath(in_path + path), os.path.abspath(out_path + path), verify=verify)
+
+
+# archive all raws of the tree, several files at once if jobs > 1
+# the transfers are i/o bound and mostly done by the kernel, so threads are enough
+# with --dedupe files that are already in the archive (or come twice) are linked to the archived copy
+def copy_raw_folder(in_path, out_path, path, verbose=True, overwrite=False, move=False, jobs=1, verify=False):
+    if jobs == 0:
+        jobs = os.cpu_count() or 1
+    transfers = []
+    archived = []
+    for folder, files in r2j_scan.Scanner(in_path).walk(path):
+        if verbose:
+            print('...' + folder + '\t\t => browsing folder')
+        for sub_path, entry in files:
+            if not is_raw_file(entry.name):
+                continue
             if os.path.exists(out_path + sub_path) and not overwrite:
                 if verbose:
                     print('...' + sub_path + '\t\t => ignored (file exists)')
+                archived.append(sub_path)
             else:
-                if verbose and move:
-                    print('...' + sub_path + '\t\t => moving file')
-                elif verbose:
-                    print('...' + sub_path + '\t\t => copying file')
+                transfers.append(sub_path)
+
+    if progress is not None:
+        progress.queued(len(transfers) + len(archived), skipped=len(archived))
+    duplicates = {}
+    if fingerprints is not None and len(transfers) > 0:
+        duplicates = fingerprints.find_duplicates(transfers, lambda sub_path: in_path + sub_path,
+                                                  stored=lambda sub_path: out_path + sub_path, known=archived)
+    duplicate_transfers = [sub_path for sub_path in transfers if sub_path in duplicates]
+    transfers = [sub_path for sub_path in transfers if sub_path not in duplicates]
+
+    def transfer(sub_path):
+        record = r2j_report.new_record(sub_path, kind='archive') if report is not None else None
+        try:
+            with r2j_report.stage(record, 'move' if move else 'copy'):
+                method = archive_file(in_path, out_path, sub_path, move=move, verify=verify)
+            if record is not None:
+                record['bytes_read'] = record['bytes_written'] = os.path.getsize(out_path + sub_path)
+                report.add(record)
+            return method, None
+        except Exception as e:
+            return None, str(e)
+
+    moved_folders = set()
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        # map() yields in submission order, which keeps the output deterministic
+        for sub_path, (method, error) in zip(transfers, executor.map(transfer, transfers)):
+            if error is not None:
+                record_error((in_path, out_path, sub_path, None), error, verbose=verbose)
+            else:
+                moved_folders.add(sub_path[:sub_path.rfind('/') + 1])
+                if verbose:
+                    print('...' + sub_path + '\t\t => ' + method)
+            if progress is not None:
+                progress.file_done(sub_path, 'done' if error is None else 'failed')
+
+    failed = set(e[2] for e in errors)
+    for sub_path in duplicate_transfers:
+        original = duplicates[sub_path]
+        if original in failed:
+            record_error((in_path, out_path, sub_path, None), 'duplicate of ' + original + ', which failed', verbose=verbose)
+            if progress is not None:
+                progress.file_done(sub_path, 'failed')
+            continue
+        record = r2j_report.new_record(sub_path, kind='link') if report is not None else None
+        try:
+            with r2j_report.stage(record, 'link'):
                 parent = out_path + sub_path[:sub_path.rfind('/') + 1]
                 if not os.path.isdir(parent):
-                    os.makedirs(parent)
+                    os.makedirs(parent, exist_ok=True)
+                method = r2j_dedupe.link_file(os.path.abspath(out_path + original), os.path.abspath(out_path + sub_path))
                 if move:
-                    shutil.move(os.path.abspath(in_path + sub_path), os.path.abspath(out_path + sub_path))
-                else:
-                    shutil.copy2(os.path.abspath(in_path + sub_path), os.path.abspath(out_path + sub_path))
+                    # same content as the archived original (compared by the full hash)
+                    os.remove(in_path + sub_path)
+        except OSError as e:
+            record_error((in_path, out_path, sub_path, None), str(e), verbose=verbose)
+            if progress is not None:
+                progress.file_done(sub_path, 'failed')
+            continue
+        if record is not None:
+            report.add(record)
+        if progress is not None:
+            progress.file_done(sub_path)
+        moved_folders.add(sub_path[:sub_path.rfind('/') + 1])
+        if verbose:
+            print('...' + sub_path + '\t\t => ' + method + ' (duplicate of ' + original + ')')
 
-                # Delete folder if there were only raws in it
-                directory = os.path.dirname(in_path + sub_path)
-                if move and len(os.listdir(directory)) == 0:
-                    if verbose:
-                        print('...' + os.path.dirname(sub_path) + '\t\t => removing directory')
-                    os.rmdir(directory)
+    # Delete folders if there were only raws in them (rmdir fails on folders that are not empty)
+    if move:
+        for folder in sorted(moved_folders, key=lambda folder: folder.count('/'), reverse=True):
+            try:
+                os.rmdir(in_path + folder)
+                if verbose:
+                    print('...' + folder + '\t\t => removing directory')
+            except OSError:
+                pass
 
 def open_gui():
     if not platform.system() == 'Linux':
         print('Gui is currently supported only on linux')
         exit(1)
+    import r2j_linuxgui as linuxgui
     linuxgui.main(sys.argv[0])
     exit(0)
 
@@ -169,6 +758,8 @@ def parse_args():
     parser.add_argument('destination', help='destination folder for converted JPG files', type=str)
     parser.add_argument('-c', '--copy', help='copies all RAW-files (recursive, maintains folder structure)',
                         action='store_true', dest='copy_mode')
+    parser.add_argument('--dedupe', help='convert or archive files with the same content only once and hardlink the other destinations '
+                        '(fingerprints are kept in the destination folder)', action='store_true', dest='dedupe')
     parser.add_argument('-e', '--enhance', help='remove bad pixels', action='store_true', dest='enhance')
     parser.add_argument('-f', '--force', help='force conversion and overwrite existing files', action='store_true',
                         dest='overwrite')
@@ -176,18 +767,73 @@ def parse_args():
                         action='store_true', dest='group_enhance')
     parser.add_argument('--gui', help='start graphical interface (linux only)',
                         action='store_true', dest='gui')
+    parser.add_argument('--half-size', help='decode at half resolution with fast interpolation (for previews)',
+                        action='store_true', dest='half_size')
+    parser.add_argument('-j', '--jobs', help='number of parallel conversion processes or archive transfers (0 uses one per cpu core, '
+                        'default is 1 or one per cpu core with --max-memory)', type=int, default=None, dest='jobs')
+    parser.add_argument('--max-memory', help='memory budget for parallel conversions like 8G (default: 3/4 of the physical memory), '
+                        'jobs are started largest first while their estimated memory fits', type=r2j_scheduler.parse_memory, dest='max_memory')
+    parser.add_argument('--no-manifest', help='do not keep track of converted files in a manifest in the destination folder',
+                        action='store_false', dest='use_manifest')
     parser.add_argument('-m', '--move', help='move all RAW-files (recursive, maintains folder structure)',
                         action='store_true', dest='move_mode')
+    parser.add_argument('-o', '--output', help='add a rendition NAME:FORMAT[:SIZE] (FORMAT: jpg, webp, tiff or tiff16, SIZE: longest edge in pixels), '
+                        'stored in the subfolder NAME of the destination (. for the destination itself), can be repeated (overwrites -t)',
+                        type=r2j_renditions.parse_rendition, action='append', dest='renditions')
+    parser.add_argument('--compression', help='compression of tiff and tiff16 files (default: none)',
+                        choices=sorted(r2j_encoders.COMPRESSIONS), dest='compression')
+    parser.add_argument('--no-optimize', help='skip the extra pass that makes jpgs a few percent smaller',
+                        action='store_true', dest='no_optimize')
+    parser.add_argument('--preset', help='encoder preset: default, fast (faster encoding, slightly larger files) or small '
+                        '(smaller files, slower encoding), other encoder options override it',
+                        choices=sorted(r2j_encoders.PRESETS), default='default', dest='preset')
+    parser.add_argument('--progressive', help='write progressive jpgs', action='store_true', dest='progressive')
+    parser.add_argument('-p', '--preview', help='extract the preview embedded by the camera instead of converting (falls back to --half-size)',
+                        action='store_true', dest='preview')
+    parser.add_argument('--progress', help='write the progress as json lines to this file (e.g. /dev/fd/3 for a pipe of a frontend)',
+                        type=str, dest='progress')
     parser.add_argument('-q', '--quiet', help='do not show any output', action='store_false', dest='verbose')
+    parser.add_argument('--quality', help='quality of jpg and webp files from 1 to 100 (default: 90)',
+                        type=r2j_encoders.parse_quality, dest='quality')
+    parser.add_argument('--report', help='write per file stage timings and a summary as json lines to this file',
+                        type=str, dest='report')
     parser.add_argument('-r', '--recursive',
                         help='convert files in subfolders recursively', action='store_true', dest='recursion')
     parser.add_argument('-s', '--stupid', help='turn on stupid mode - other files do not get copied automatically',
                         action='store_false', dest='smart_mode')
+    parser.add_argument('--shard', help='convert the files of shard I of N (0 <= I < N) first and then help the other shards, '
+                        'for several nodes converting the same tree into a shared destination', type=r2j_shard.parse_shard, dest='shard')
+    parser.add_argument('--subsampling', help='chroma subsampling of jpgs (default: 4:2:0)',
+                        choices=sorted(r2j_encoders.SUBSAMPLING), dest='subsampling')
     parser.add_argument('-t', '--tiff', help='convert into tiffs instead of jpgs',
                         action='store_true', dest='tiff')
+    parser.add_argument('-u', '--skip-unchanged', help='do not look into source folders that did not change since the last run (uses the manifest)',
+                        action='store_true', dest='skip_unchanged')
+    parser.add_argument('-v', '--verify', help='verify archived files with a checksum (before deleting the source in move mode)',
+                        action='store_true', dest='verify')
     parser.add_argument('-w', '--auto-wb', help='use automatic white balance instead of the cameras white balance',
                         action='store_true', dest='auto_wb')
-    return parser.parse_args()
+    parser.add_argument('--watch', help='keep running and convert new files as soon as they are completely written (linux only)',
+                        action='store_true', dest='watch')
+    args = parser.parse_args()
+    if args.dedupe and args.shard:
+        parser.error('--dedupe can not be combined with --shard')
+    if args.renditions:
+        # renditions with the same name and file ending would overwrite each other
+        targets = set()
+        for name, fmt, size in args.renditions:
+            target = (name, r2j_renditions.FORMATS[fmt])
+            if target in targets:
+                parser.error('argument -o/--output: more than one rendition writes ' + os.path.join(name or '.', '*' + target[1]))
+            targets.add(target)
+    if args.jobs is not None and args.jobs < 0:
+        parser.error('argument -j/--jobs: must be 0 or more')
+    if args.jobs is None:
+        args.jobs = 0 if args.max_memory else 1
+    args.encoder = r2j_encoders.encoder_settings(args.preset, quality=args.quality, optimize=False if args.no_optimize else None,
+                                                 progressive=True if args.progressive else None, subsampling=args.subsampling,
+                                                 compression=args.compression)
+    return args
 
 
 # call function
@@ -201,10 +847,21 @@ if __name__ == "__main__":
         import rawpy.enhance
 
     start_time = datetime.now()
+    if args.report:
+        report = r2j_report.Report(args.report)
+    if args.progress:
+        progress = r2j_progress.Progress(args.progress)
+    if args.shard and not (args.copy_mode or args.move_mode or is_raw_file(args.source)):
+        leases = r2j_shard.Leases(args.destination, args.shard, verbose=args.verbose)
+    if args.dedupe and not is_raw_file(args.source):
+        fingerprints = r2j_dedupe.Index(args.destination)
 
     try:
+        if args.watch and (args.copy_mode or args.move_mode or is_raw_file(args.source)):
+            print("Watch mode only converts folders!")
+            exit(1)
         if args.copy_mode or args.move_mode:
-            if args.source.endswith(RAW_FILE_ENDINGS):
+            if is_raw_file(args.source):
                 print("Only folders are accepted as input in copy/move mode!")
                 exit(1)
             else:
@@ -212,10 +869,11 @@ if __name__ == "__main__":
                     print('Archiving all files in ' + args.source)
                     print('\tinto ' + args.destination)
                     print()
-                copy_raw_folder(args.source, args.destination, '', verbose=args.verbose, overwrite=args.overwrite, move=args.move_mode)
+                copy_raw_folder(args.source, args.destination, '', verbose=args.verbose, overwrite=args.overwrite, move=args.move_mode,
+                                jobs=args.jobs, verify=args.verify)
         elif args.group_enhance:
             import rawpy.enhance
-            if args.source.endswith(RAW_FILE_ENDINGS):
+            if is_raw_file(args.source):
                 print("Only folders are accepted as input in group enhance mode!")
                 exit(1)
             else:
@@ -223,33 +881,63 @@ if __name__ == "__main__":
                     print('Converting all files in ' + args.source)
                     print('\tinto ' + args.destination + ' \t(group enchancing enabled)')
                     print()
-                process_folder_ge(args.source, args.destination, '', recursion=args.recursion,
-                               verbose=args.verbose, overwrite=args.overwrite, smart_mode=args.smart_mode,
-                               auto_wb=args.auto_wb, tiff=args.tiff)
+                if args.watch:
+                    watch_folder(args.source, args.destination, recursion=args.recursion,
+                                 verbose=args.verbose, overwrite=args.overwrite, smart_mode=args.smart_mode,
+                                 auto_wb=args.auto_wb, tiff=args.tiff, preview=args.preview, half_size=args.half_size,
+                                 renditions=args.renditions, encoder=args.encoder, jobs=args.jobs, use_manifest=args.use_manifest,
+                                 skip_unchanged=args.skip_unchanged, group_enhance=True, max_memory=args.max_memory)
+                else:
+                    process_folder_ge(args.source, args.destination, '', recursion=args.recursion,
+                                   verbose=args.verbose, overwrite=args.overwrite, smart_mode=args.smart_mode,
+                                   auto_wb=args.auto_wb, tiff=args.tiff, preview=args.preview, half_size=args.half_size,
+                                   renditions=args.renditions, encoder=args.encoder, jobs=args.jobs, use_manifest=args.use_manifest,
+                                   skip_unchanged=args.skip_unchanged, max_memory=args.max_memory)
         else:
-            if args.source.endswith(RAW_FILE_ENDINGS):
+            if is_raw_file(args.source):
                 if args.verbose:
                     print('Converting ' + args.source)
                     print('\tinto ' + args.destination)
                     print()
-                convert_raw_to_jpg(args.source, args.destination, '', verbose=args.verbose, overwrite=args.overwrite, auto_wb=args.auto_wb, enhance=args.enhance, tiff=args.tiff)
+                run_conversions([(args.source, args.destination, '',
+                                  dict(verbose=args.verbose, overwrite=args.overwrite, auto_wb=args.auto_wb, enhance=args.enhance, tiff=args.tiff,
+                                       preview=args.preview, half_size=args.half_size, renditions=args.renditions, encoder=args.encoder))],
+                                verbose=args.verbose, use_manifest=args.use_manifest)
             else:
                 if args.verbose:
                     print('Converting all files in ' + args.source)
                     print('\tinto ' + args.destination)
                     print()
-                process_folder(args.source, args.destination, '', recursion=args.recursion,
-                               verbose=args.verbose, overwrite=args.overwrite, smart_mode=args.smart_mode,
-                               auto_wb=args.auto_wb, enhance=args.enhance, tiff=args.tiff)
+                if args.watch:
+                    watch_folder(args.source, args.destination, recursion=args.recursion,
+                                 verbose=args.verbose, overwrite=args.overwrite, smart_mode=args.smart_mode,
+                                 auto_wb=args.auto_wb, enhance=args.enhance, tiff=args.tiff, preview=args.preview, half_size=args.half_size,
+                                 renditions=args.renditions, encoder=args.encoder, jobs=args.jobs, use_manifest=args.use_manifest,
+                                 skip_unchanged=args.skip_unchanged, max_memory=args.max_memory)
+                else:
+                    process_folder(args.source, args.destination, '', recursion=args.recursion,
+                                   verbose=args.verbose, overwrite=args.overwrite, smart_mode=args.smart_mode,
+                                   auto_wb=args.auto_wb, enhance=args.enhance, tiff=args.tiff, preview=args.preview, half_size=args.half_size,
+                                   renditions=args.renditions, encoder=args.encoder, jobs=args.jobs, use_manifest=args.use_manifest,
+                                   skip_unchanged=args.skip_unchanged, max_memory=args.max_memory)
     except KeyboardInterrupt:
         print('\nQuitting early because of interrupt signal...')
 
+    if report is not None:
+        report.close()
+    if leases is not None:
+        leases.close()
+    if fingerprints is not None:
+        fingerprints.close()
+    if progress is not None:
+        progress.close()
+
     if args.verbose:
         print()
         if len(errors) > 0:
             print(str(len(errors)) + ' errors occured:')
             for e in errors:
-                print('\t' + e[0] + e[2])
+                print('\t' + e[0] + e[2] + ': ' + e[3])
         else:
             print('No errors occured')
         print()